@@ -0,0 +1,107 @@
+"""
+AlertStreamConsumer ni soxta terminalga (bench.fake_device) ulab tekshiradi: multipart oqim tahlili,
+uzilishdan keyin qayta ulanish va backoff. Hodisalar process_event o'rniga ro'yxatga yig'iladi,
+shuning uchun Redis va Postgres kerak emas.
+
+    python -m bench.alert_stream --connections 4 --events 5 --fail-first 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+# core.config import qilinishidan oldin: bench haqiqiy servislarsiz ishlaydi
+for _name, _value in {
+    "BOT_TOKEN": "0:bench", "SUPER_ADMIN_ID": "0",
+    "POSTGRES_USER": "bench", "POSTGRES_PASSWORD": "bench", "POSTGRES_DB": "bench",
+    "POSTGRES_HOST": "localhost", "POSTGRES_PORT": "5432",
+    "SERVER_PORT": "8000", "GOOGLE_SPREADSHEET_ID": "bench",
+    "ALERT_STREAM_MAX_BACKOFF": "4",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+from .fake_device import FakeAlertStreamDevice
+
+
+def run(args) -> dict:
+    from core.alert_stream import AlertStreamConsumer
+
+    device = FakeAlertStreamDevice(
+        events_per_connection=args.events, fail_first=args.fail_first,
+        picture_kb=args.picture_kb, interval=args.interval_ms / 1000,
+    )
+    device.start()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="bench-loop", daemon=True).start()
+
+    received = []
+    connected = []
+
+    async def handler(data, event_time=None):
+        received.append(data)
+        return {"status": "success"}
+
+    consumer = AlertStreamConsumer(loop, handler, scheme="http", on_connect=lambda dev: connected.append(time.monotonic()))
+    target = {'ip': device.address, 'user': "admin", 'pass': "bench"}
+
+    started = time.perf_counter()
+    # start() qurilmalarni bazadan o'qiydi; bu yerda ro'yxat to'g'ridan-to'g'ri beriladi
+    consumer.sync_devices({(target['ip'], target['user'], target['pass']): target})
+
+    expected = args.connections * args.events
+    deadline = time.monotonic() + args.timeout
+    while len(received) < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    consumer.stop()
+    device.stop()
+    loop.call_soon_threadsafe(loop.stop)
+
+    serials = [event["AccessControllerEvent"]["serialNo"] for event in received]
+    # Oxirgi ulanish to'xtatilganda hali yuborilayotgan bo'lishi mumkin
+    last = max(serials, default=0)
+    sent = {s for s in device.sent_serials if s <= last}
+    gaps = [b - a for a, b in zip(device.connections, device.connections[1:])]
+    return {
+        "elapsed_seconds": elapsed,
+        "connections": len(device.connections),
+        "rejected_connections": min(args.fail_first, len(device.connections)),
+        "streams": len(connected),
+        "events_sent": len(device.sent_serials),
+        "events_received": len(received),
+        "missing": sorted(sent - set(serials))[:20],
+        "duplicates": len(serials) - len(set(serials)),
+        "non_events_dispatched": sum(1 for e in received if e.get("eventType") != "AccessControllerEvent"),
+        "ip_from_connection": all(e.get("ipAddress") == device.address for e in received),
+        "reconnect_gaps": [round(g, 2) for g in gaps],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="alertStream iste'molchisi uchun soxta terminal sinovi")
+    parser.add_argument("--connections", type=int, default=3, help="nechta muvaffaqiyatli ulanish kutiladi")
+    parser.add_argument("--events", type=int, default=5, help="har bir ulanishda, keyin uziladi")
+    parser.add_argument("--fail-first", type=int, default=2, help="birinchi N ta ulanishga 503")
+    parser.add_argument("--picture-kb", type=int, default=60)
+    parser.add_argument("--interval-ms", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    for key, value in result.items():
+        print(f"{key:<24}{value}")
+    ok = (result["events_received"] >= args.connections * args.events and not result["missing"]
+          and not result["duplicates"] and not result["non_events_dispatched"] and result["ip_from_connection"])
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
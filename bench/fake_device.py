@@ -0,0 +1,171 @@
+"""
+Soxta Hikvision terminali: /ISAPI/Event/notification/alertStream da multipart/mixed oqim beradi.
+Har bir ulanishda hodisa JSON qismlari, yuz suratlari va heartbeat qismlari yuboriladi,
+so'ng ulanish surat o'rtasida uziladi — AlertStreamConsumer ning tahlilchisi va
+qayta ulanish/backoff mantig'ini haqiqiy qurilmasiz tekshirish uchun.
+"""
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ALERT_STREAM_PATH = "/ISAPI/Event/notification/alertStream"
+
+
+def access_event(device_ip, employee_id, sub_event_type, serial_no):
+    """Qurilma push qiladigan AccessControllerEvent (device_ip=None bo'lsa ipAddress yuborilmaydi)."""
+    event = {
+        "portNo": 80,
+        "protocol": "HTTP",
+        "macAddress": "bc:ba:c2:00:00:00",
+        "channelID": 1,
+        "dateTime": time.strftime("%Y-%m-%dT%H:%M:%S+05:00"),
+        "activePostCount": 1,
+        "eventType": "AccessControllerEvent",
+        "eventState": "active",
+        "eventDescription": "Access Controller Event",
+        "AccessControllerEvent": {
+            "deviceName": "Access Controller",
+            "majorEventType": 5,
+            "subEventType": sub_event_type,
+            "name": f"Xodim {employee_id}",
+            "cardReaderKind": 1,
+            "cardReaderNo": 1,
+            "verifyNo": 1,
+            "employeeNoString": employee_id,
+            "serialNo": serial_no,
+            "userType": "normal",
+            "currentVerifyMode": "cardOrFace",
+            "attendanceStatus": "undefined",
+            "statusValue": 0,
+            "mask": "no",
+            "picturesNumber": 1,
+        },
+    }
+    if device_ip:
+        event["ipAddress"] = device_ip
+    return event
+
+
+def _heartbeat():
+    return {
+        "dateTime": time.strftime("%Y-%m-%dT%H:%M:%S+05:00"),
+        "activePostCount": 0,
+        "eventType": "videoloss",
+        "eventState": "inactive",
+        "eventDescription": "videoloss alarm",
+    }
+
+
+def _part(boundary: bytes, content_type: str, body: bytes) -> bytes:
+    return b"".join([
+        b"--" + boundary + b"\r\n",
+        f"Content-Type: {content_type}\r\n".encode(),
+        f"Content-Length: {len(body)}\r\n\r\n".encode(),
+        body,
+        b"\r\n",
+    ])
+
+
+class _AlertStreamHandler(BaseHTTPRequestHandler):
+    # HTTP/1.0: tana ulanish yopilguncha o'qiladi, xuddi terminaldagidek
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        device = self.server.device
+        if self.path.split("?")[0] != ALERT_STREAM_PATH:
+            self.send_error(404)
+            return
+
+        connection_no = device.on_connect()
+        if connection_no <= device.fail_first:
+            self.send_error(503, "Device busy")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/mixed; boundary={device.boundary.decode()}")
+        self.end_headers()
+        try:
+            for part in device.stream_parts():
+                self._write_split(part)
+                if device.interval:
+                    time.sleep(device.interval)
+            # Ulanish yopuvchi chegarasiz, surat o'rtasida uziladi
+            self._write_split(device.truncated_picture())
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_split(self, data: bytes):
+        """Bo'laklarni tasodifiy joyidan bo'lib yuboradi: chegara ikki TCP paket orasiga tushishi uchun."""
+        view = memoryview(data)
+        while view:
+            size = random.randint(1, max(1, min(len(view), 4096)))
+            self.wfile.write(view[:size])
+            self.wfile.flush()
+            view = view[size:]
+
+
+class FakeAlertStreamDevice:
+    """
+    events_per_connection ta hodisadan keyin ulanish uziladi; birinchi fail_first ta ulanish 503 oladi.
+    Hodisalarning serialNo lari ulanishlar bo'ylab uzluksiz o'sadi. ipAddress — lan_ip (ro'yxatdagi manzil emas).
+    """
+    def __init__(self, host="127.0.0.1", port=0, events_per_connection=5, fail_first=0,
+                 picture_kb=60, heartbeat_every=3, interval=0.0, employees=50, lan_ip="192.168.1.64"):
+        self.events_per_connection = events_per_connection
+        self.fail_first = fail_first
+        self.picture = b"\xff\xd8\xff\xe0" + os.urandom(picture_kb * 1024)
+        self.heartbeat_every = heartbeat_every
+        self.interval = interval
+        self.employees = [str(100000 + i) for i in range(employees)]
+        self.boundary = b"boundary"
+        # NAT ortidagi terminal kabi hodisada o'zining LAN manzilini yuboradi
+        self.lan_ip = lan_ip
+
+        self.serial_no = 0
+        self.connections = []  # ulanish vaqtlari (monotonic)
+        self.sent_serials = []
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), _AlertStreamHandler)
+        self._server.daemon_threads = True
+        self._server.device = self
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-alert-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def on_connect(self) -> int:
+        with self._lock:
+            self.connections.append(time.monotonic())
+            return len(self.connections)
+
+    def stream_parts(self):
+        for i in range(self.events_per_connection):
+            if self.heartbeat_every and i % self.heartbeat_every == 0:
+                yield _part(self.boundary, "application/json", json.dumps(_heartbeat()).encode())
+            with self._lock:
+                self.serial_no += 1
+                serial_no = self.serial_no
+                self.sent_serials.append(serial_no)
+            event = access_event(self.lan_ip, random.choice(self.employees), random.choice((75, 22)), serial_no)
+            yield _part(self.boundary, 'application/json; charset="UTF-8"', json.dumps(event).encode())
+            yield _part(self.boundary, "image/jpeg", self.picture)
+
+    def truncated_picture(self) -> bytes:
+        return _part(self.boundary, "image/jpeg", self.picture)[:len(self.picture) // 2]
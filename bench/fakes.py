@@ -0,0 +1,246 @@
+"""Benchmark uchun jarayon ichidagi Redis, Postgres, Sheets va Telegram o'rnini bosuvchilar."""
+import asyncio
+import json
+import time
+
+from core.cache import RESOLVE_EVENT_LUA, CHECK_EVENT_LUA, RESTORE_STATE_LUA, SERIAL_REUSE_MS
+
+
+class FakeAsyncRedis:
+    """
+    redis.asyncio.Redis ning ingest ishlatadigan qismi. Lua skriptlar Pythonda takrorlangan,
+    har bir buyruq (yoki pipeline/skript) bitta sun'iy tarmoq kechikishini oladi.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.values = {}
+        # key -> {member: score}
+        self.sorted_sets = {}
+
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _get(self, key):
+        item = self.values.get(key)
+        if item is None: return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def _set(self, key, value, ex=None, px=None):
+        ttl = ex if ex is not None else (px / 1000 if px is not None else None)
+        self.values[key] = (str(value), time.monotonic() + float(ttl) if ttl is not None else None)
+
+    async def ping(self):
+        return True
+
+    async def close(self):
+        pass
+
+    async def get(self, key):
+        await self._round_trip()
+        return self._get(key)
+
+    async def set(self, key, value, ex=None, px=None):
+        await self._round_trip()
+        self._set(key, value, ex, px)
+
+    async def delete(self, *keys):
+        await self._round_trip()
+        self._delete(*keys)
+
+    async def zrem(self, key, member):
+        await self._round_trip()
+        self.sorted_sets.get(key, {}).pop(int(member), None)
+
+    def _delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.sorted_sets.pop(key, None)
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        handlers = {
+            RESOLVE_EVENT_LUA: self._resolve_event,
+            CHECK_EVENT_LUA: self._check_event,
+            RESTORE_STATE_LUA: self._restore_state,
+        }
+
+        async def run(keys, args):
+            await self._round_trip()
+            return handlers[script](keys, args)
+        return run
+
+    def _is_repeated(self, seen_key, pass_key, serial, event_ms, window_ms, seen_max):
+        last = self._get(pass_key)
+        previous = last or ""
+        if serial != "":
+            seen = self.sorted_sets.setdefault(seen_key, {})
+            serial = int(serial)
+            if serial in seen and abs(event_ms - seen[serial]) < SERIAL_REUSE_MS:
+                return True, previous
+            seen[serial] = event_ms
+            while len(seen) > seen_max:
+                del seen[min(seen, key=lambda member: (seen[member], member))]
+        if window_ms > 0:
+            if last is not None and abs(event_ms - int(last)) < window_ms:
+                return True, previous
+            if last is None or event_ms > int(last):
+                self._set(pass_key, event_ms, px=window_ms)
+        return False, previous
+
+    def _apply_state(self, state_key, action, event_ms, ttl):
+        previous = self._get(state_key) or ""
+        if action not in ("KIRISH", "CHIQISH"):
+            return 1, previous
+        last_action, _, last_ms = previous.partition("|")
+        if int(event_ms) < int(last_ms or 0):
+            return 1, previous
+        if last_action == action:
+            return 2, previous
+        self._set(state_key, f"{action}|{event_ms}", ex=ttl)
+        return 1, previous
+
+    def _check_event(self, keys, args):
+        action, ttl, serial, event_ms, window_ms, seen_max = args
+        repeated, previous_pass = self._is_repeated(keys[1], keys[2], serial, event_ms, window_ms, seen_max)
+        if repeated:
+            return [4, "", previous_pass]
+        code, previous_state = self._apply_state(keys[0], action, event_ms, ttl)
+        return [code, previous_state, previous_pass]
+
+    def _restore_state(self, keys, args):
+        for i, key in enumerate(keys):
+            written, previous, ttl = args[i * 3:i * 3 + 3]
+            if self._get(key) == str(written):
+                if previous == "":
+                    self._delete(key)
+                else:
+                    self._set(key, previous, px=ttl)
+        return 1
+
+    def _resolve_event(self, keys, args):
+        device = self._get(keys[0])
+        if device is None:
+            return [3, "", "", "", "", ""]
+        employee = self._get(keys[1]) or ""
+
+        action, ttl, serial, event_ms, window_ms, seen_max = args
+        device_type = json.loads(device)["device_type"]
+        if device_type == "entry":
+            action = "KIRISH"
+        elif device_type == "exit":
+            action = "CHIQISH"
+
+        repeated, previous_pass = self._is_repeated(keys[3], keys[4], serial, event_ms, window_ms, seen_max)
+        if repeated:
+            return [4, device, employee, action, "", previous_pass]
+        code, previous_state = self._apply_state(keys[2], action, event_ms, ttl)
+        return [code, device, employee, action, previous_state, previous_pass]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def delete(self, *keys):
+        self.commands.append(lambda: self.redis._delete(*keys))
+
+    def zrem(self, key, member):
+        self.commands.append(lambda: self.redis.sorted_sets.get(key, {}).pop(int(member), None))
+
+    async def execute(self):
+        await self.redis._round_trip()
+        for command in self.commands:
+            command()
+        self.commands = []
+
+
+def install_fake_redis(async_cache, fake):
+    """AsyncCacheManager ni soxta Redisga ulaydi (connect() va pub/sub chaqirilmaydi)."""
+    async_cache.redis = fake
+    async_cache._resolve_script = fake.register_script(RESOLVE_EVENT_LUA)
+    async_cache._event_script = fake.register_script(CHECK_EVENT_LUA)
+    async_cache._restore_script = fake.register_script(RESTORE_STATE_LUA)
+    async_cache.local.clear()
+
+
+class _EmptyResult:
+    def first(self):
+        return None
+
+    def scalars(self):
+        return self
+
+
+class FakeAsyncSession:
+    """AsyncSession o'rnida: navbatga yozilgan yozuvlarni ro'yxatga yig'adi."""
+    _next_id = 0
+
+    def __init__(self, entries: list, latency: float = 0.0):
+        self.entries = entries
+        self.latency = latency
+        self._pending = []
+
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def execute(self, statement):
+        await self._round_trip()
+        return _EmptyResult()
+
+    def add(self, entry):
+        self._pending.append(entry)
+
+    async def commit(self):
+        await self._round_trip()
+        for entry in self._pending:
+            FakeAsyncSession._next_id += 1
+            entry.id = FakeAsyncSession._next_id
+        self.entries.extend(self._pending)
+        self._pending = []
+
+    async def close(self):
+        pass
+
+
+class FakeSheetManager:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.rows = 0
+        self.calls = 0
+
+    def append_attendance_rows(self, sheet_id, date_str, rows):
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls += 1
+        self.rows += len(rows)
+
+
+class _OkResponse:
+    ok = True
+    status_code = 200
+    text = '{"ok":true}'
+
+    def json(self):
+        return {"ok": True}
+
+
+class FakeTelegramSession:
+    """requests.Session o'rnida: sendMessage ni darhol muvaffaqiyatli qaytaradi."""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.messages = 0
+
+    def post(self, url, json=None, timeout=None):
+        if self.latency:
+            time.sleep(self.latency)
+        self.messages += 1
+        return _OkResponse()
@@ -0,0 +1,297 @@
+"""
+Ingest yo'lining yuklama testi: N ta simulyatsiya qilingan qurilma FastAPI ilovasiga
+JSON va multipart AccessControllerEvent yuboradi. Redis, Postgres, Sheets va Telegram
+jarayon ichidagi soxta (fake) obyektlar bilan almashtiriladi, shuning uchun natija
+faqat bizning kodimiz sarflagan vaqtni ko'rsatadi (+ berilgan sun'iy kechikish).
+
+    python -m bench.ingest --devices 50 --events 200 --multipart 0.5
+    python -m bench.ingest --json > bench_output.txt
+
+Qo'shimcha bog'liqlik: pip install -r bench/requirements.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+# core.config import qilinishidan oldin: bench haqiqiy servislarsiz ishlaydi
+for _name, _value in {
+    "BOT_TOKEN": "0:bench", "SUPER_ADMIN_ID": "0",
+    "POSTGRES_USER": "bench", "POSTGRES_PASSWORD": "bench", "POSTGRES_DB": "bench",
+    "POSTGRES_HOST": "localhost", "POSTGRES_PORT": "5432",
+    "SERVER_PORT": "8000", "GOOGLE_SPREADSHEET_ID": "bench",
+    "ALERT_STREAM_ENABLED": "false", "BACKFILL_ENABLED": "false",
+    # Bir xodimning ketma-ket o'tishlari soniyalar ichida simulyatsiya qilinadi
+    "DEDUP_WINDOW_SECONDS": "0",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+import httpx
+
+from .fake_device import access_event
+from .fakes import FakeAsyncRedis, FakeAsyncSession, FakeSheetManager, FakeTelegramSession, install_fake_redis
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.outcomes = Counter()
+
+    def wrap_async(self, stage, fn):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - started)
+        return wrapper
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+
+def _percentile(values, q):
+    if not values: return 0.0
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples):
+    report = {}
+    for stage, values in samples.items():
+        values = sorted(values)
+        report[stage] = {
+            "count": len(values),
+            "p50_ms": _percentile(values, 0.50) * 1000,
+            "p95_ms": _percentile(values, 0.95) * 1000,
+            "p99_ms": _percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    return report
+
+
+def multipart_body(event: dict, picture: bytes, boundary: str = "MIME_boundary"):
+    """Hikvision HTTP push ko'rinishi: JSON qism va undan keyin yuz surati."""
+    payload = json.dumps(event).encode()
+    body = b"".join([
+        f"--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="AccessControllerEvent"\r\n',
+        b"Content-Type: application/json\r\n",
+        f"Content-Length: {len(payload)}\r\n\r\n".encode(),
+        payload,
+        f"\r\n--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="Picture"; filename="Picture.jpg"\r\n',
+        b"Content-Type: image/jpeg\r\n",
+        f"Content-Length: {len(picture)}\r\n\r\n".encode(),
+        picture,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Directory:
+    """Simulyatsiya qilinadigan filiallar, qurilmalar va xodimlar."""
+    def __init__(self, devices, readers_per_branch, employees, notif_ratio):
+        from core.models import Branch, Device, DeviceType, Employee
+
+        self.branches = []
+        self.devices = []
+        self.employees_by_branch = defaultdict(list)
+        self.employees = []
+
+        branch_count = max(1, devices // readers_per_branch)
+        for b in range(branch_count):
+            self.branches.append(Branch(id=b + 1, name=f"Filial {b + 1}", attendance_sheet_id=f"sheet-{b + 1}"))
+        for d in range(devices):
+            branch = self.branches[d % branch_count]
+            self.devices.append((
+                Device(ip_address=f"10.0.{d // 250}.{d % 250 + 1}", branch_id=branch.id, device_type=DeviceType.UNIVERSAL),
+                branch,
+            ))
+        for e in range(employees):
+            branch = self.branches[e % branch_count]
+            employee = Employee(
+                account_id=str(100000 + e),
+                full_name=f"xodim {e}",
+                branch_id=branch.id,
+                notification_chat_id=(5000000 + e) if random.random() < notif_ratio else None,
+            )
+            self.employees.append(employee)
+            self.employees_by_branch[branch.id].append(employee)
+
+
+async def simulate_device(client, device, branch, directory, args, picture, timer, next_action, serials):
+    employees = directory.employees_by_branch[branch.id]
+    for _ in range(args.events):
+        employee = random.choice(employees)
+        # Xodim navbat bilan kiradi va chiqadi, shunda holat tekshiruvi asosan o'tkazib yuboradi
+        sub_event_type = next_action.get(employee.account_id, 75)
+        next_action[employee.account_id] = 22 if sub_event_type == 75 else 75
+
+        serials[device.ip_address] += 1
+        event = access_event(device.ip_address, employee.account_id, sub_event_type, serials[device.ip_address])
+        if random.random() < args.multipart:
+            body, content_type = multipart_body(event, picture)
+        else:
+            body, content_type = json.dumps(event).encode(), "application/json"
+
+        started = time.perf_counter()
+        resp = await client.post("/api/hikvision/event", content=body, headers={"content-type": content_type})
+        timer.record("request", time.perf_counter() - started)
+        timer.outcomes[resp.json().get("msg", resp.status_code)] += 1
+
+
+async def run_ingest(args, timer, session_factory):
+    # hik_server import paytida GoogleSheetManager yaratadi (servis hisobi fayli kerak bo'ladi)
+    import core.sheets
+    core.sheets.GoogleSheetManager = FakeSheetManager
+    from core import hik_server
+    from core.cache import async_cache
+    from core.database import get_async_db
+
+    fake_redis = FakeAsyncRedis(latency=args.redis_latency_ms / 1000)
+    install_fake_redis(async_cache, fake_redis)
+
+    directory = Directory(args.devices, args.readers_per_branch, args.employees, args.notif_ratio)
+    for device, branch in directory.devices:
+        await async_cache.set_device_info(device, branch)
+    for employee in directory.employees:
+        await async_cache.set_employee_info(employee)
+    if args.cold_l1:
+        async_cache.local.clear()
+
+    async def fake_db():
+        yield session_factory()
+
+    hik_server.app.dependency_overrides[get_async_db] = fake_db
+    hik_server.read_multipart_event = timer.wrap_async("parse.multipart", hik_server.read_multipart_event)
+    hik_server.enqueue_async = timer.wrap_async("db.enqueue", hik_server.enqueue_async)
+    async_cache.resolve_event = timer.wrap_async("cache.resolve", async_cache.resolve_event)
+    async_cache.check_event = timer.wrap_async("cache.check_event", async_cache.check_event)
+
+    picture = b"\xff\xd8\xff\xe0" + os.urandom(args.picture_kb * 1024)
+    next_action, serials = {}, defaultdict(int)
+
+    transport = httpx.ASGITransport(app=hik_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            simulate_device(client, device, branch, directory, args, picture, timer, next_action, serials)
+            for device, branch in directory.devices
+        ])
+        elapsed = time.perf_counter() - started
+
+    hik_server.app.dependency_overrides.clear()
+    return elapsed
+
+
+def run_delivery(args, timer, entries):
+    """Navbatdagi yozuvlarni Sheets (partiyalab) va Telegram dispetcheri orqali soxta servislarga yetkazadi."""
+    from core.config import settings
+    from core.notifier import TelegramDispatcher
+    from core.outbox import OutboxWorker, format_alert
+
+    # Flood limitlari o'lchanmaydi, faqat dispetcherning o'z xarajati
+    dispatcher = TelegramDispatcher(settings.BOT_TOKEN, global_rate=1e9, chat_rate=1e9)
+    dispatcher.session = FakeTelegramSession(latency=args.telegram_latency_ms / 1000)
+    worker = OutboxWorker(FakeSheetManager(latency=args.sheets_latency_ms / 1000), dispatcher)
+
+    started = time.perf_counter()
+    for start in range(0, len(entries), worker.batch_size):
+        batch = entries[start:start + worker.batch_size]
+        errors = {}
+        batch_started = time.perf_counter()
+        worker._deliver_sheets(batch, errors)
+        timer.record("sheets.batch", time.perf_counter() - batch_started)
+    sheets_elapsed = time.perf_counter() - started
+
+    alerts = [e for e in entries if e.notif_chat_id]
+
+    def on_result(submitted_at, ok, error, permanent):
+        timer.record("telegram.alert", time.perf_counter() - submitted_at)
+
+    dispatcher.start()
+    started = time.perf_counter()
+    for entry in alerts:
+        dispatcher.submit(entry.notif_chat_id, format_alert(entry), _bind(on_result, time.perf_counter()))
+    dispatcher.stop(timeout=max(30, len(alerts) * 0.01))
+    telegram_elapsed = time.perf_counter() - started
+
+    return sheets_elapsed, telegram_elapsed, len(alerts)
+
+
+def _bind(fn, submitted_at):
+    return lambda ok, error, permanent: fn(submitted_at, ok, error, permanent)
+
+
+def print_report(args, result):
+    print(f"Qurilmalar: {args.devices}, har biridan {args.events} hodisa, multipart ulushi {args.multipart:.0%}")
+    print(f"Ingest: {result['events']} hodisa {result['ingest_seconds']:.2f}s — {result['events_per_second']:.0f} hodisa/s")
+    print(f"Navbatga tushdi: {result['queued']}, Sheets: {result['sheets_rows_per_second']:.0f} qator/s, "
+          f"Telegram: {result['alerts']} xabar / {result['telegram_seconds']:.2f}s")
+    print()
+    print(f"{'bosqich':<24}{'soni':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, row in sorted(result["stages"].items()):
+        print(f"{stage:<24}{row['count']:>8}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['p99_ms']:>10.3f}{row['max_ms']:>10.3f}")
+    print()
+    for outcome, count in sorted(result["outcomes"].items(), key=lambda item: -item[1]):
+        print(f"{outcome:<40}{count:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Hikvision ingest yuklama testi")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--events", type=int, default=100, help="har bir qurilmadan")
+    parser.add_argument("--employees", type=int, default=2000)
+    parser.add_argument("--readers-per-branch", type=int, default=2)
+    parser.add_argument("--multipart", type=float, default=0.5, help="multipart yuborishlar ulushi")
+    parser.add_argument("--picture-kb", type=int, default=60)
+    parser.add_argument("--notif-ratio", type=float, default=0.3)
+    parser.add_argument("--cold-l1", action="store_true", help="L1 keshsiz boshlash")
+    parser.add_argument("--redis-latency-ms", type=float, default=0.2)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--sheets-latency-ms", type=float, default=0.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="natijani JSON ko'rinishida chiqarish")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+
+    timer = StageTimer()
+    entries = []
+
+    def session_factory():
+        return FakeAsyncSession(entries, latency=args.db_latency_ms / 1000)
+
+    ingest_seconds = asyncio.run(run_ingest(args, timer, session_factory))
+    sheets_seconds, telegram_seconds, alerts = run_delivery(args, timer, entries)
+
+    events = args.devices * args.events
+    result = {
+        "events": events,
+        "queued": len(entries),
+        "ingest_seconds": ingest_seconds,
+        "events_per_second": events / ingest_seconds if ingest_seconds else 0.0,
+        "sheets_rows_per_second": len(entries) / sheets_seconds if sheets_seconds else 0.0,
+        "telegram_seconds": telegram_seconds,
+        "alerts": alerts,
+        "stages": summarize(timer.samples),
+        "outcomes": dict(timer.outcomes),
+    }
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(args, result)
+
+
+if __name__ == "__main__":
+    main()
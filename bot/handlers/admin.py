@@ -1,6 +1,7 @@
-import random
-import string
+import os
+import tempfile
 import time
+import zipfile
 from telegram import Update, ReplyKeyboardRemove, ReplyKeyboardMarkup
 from telegram.ext import CallbackContext, ConversationHandler
 from sqlalchemy.orm import Session
@@ -11,6 +12,11 @@ from core.database import SessionLocal
 from core.models import Branch, Device, Employee, DeviceType
 from core.sheets import GoogleSheetManager
 from core.config import settings
+from core.cache import cache
+from core.bulk_import import import_faces_from_zip
+from core.reconcile import reconcile_branch, reconcile_device_by_ip
+from core.directory_sync import run_directory_sync
+from core.stats import branch_stats, invalidate_branch_stats
 
 # --- YORDAMCHI FUNKSIYALAR ---
 
@@ -21,13 +27,6 @@ def cancel(update: Update, context: CallbackContext):
     update.message.reply_text("🚫 Jarayon bekor qilindi.", reply_markup=keyboards.get_admin_keyboard())
     return ConversationHandler.END
 
-def generate_new_id():
-    return ''.join(random.choices(string.digits, k=6))
-
-def normalize_text(text):
-    if not text: return ""
-    return text.lower().replace(" ", "")
-
 def add_branch_start(update: Update, context: CallbackContext):
     if update.effective_user.id != settings.SUPER_ADMIN_ID:
         return ConversationHandler.END
@@ -70,6 +69,7 @@ def get_branch_sheet(update: Update, context: CallbackContext):
         new_branch = Branch(name=context.user_data['b_name'], attendance_sheet_id=sheet_id)
         db.add(new_branch)
         db.commit()
+        invalidate_branch_stats()
         update.message.reply_text(
             f"✅ **Filial muvaffaqiyatli qo'shildi!**\n\n"
             f"🏢 Nomi: `{new_branch.name}`\n"
@@ -174,6 +174,8 @@ def get_dev_type(update: Update, context: CallbackContext):
         )
         db.add(new_device)
         db.commit()
+        cache.set_devices([(new_device, new_device.branch)])
+        invalidate_branch_stats()
         update.message.reply_text(
             f"✅ **Qurilma muvaffaqiyatli qo'shildi!**\n\n"
             f"🌐 IP: `{context.user_data['d_ip']}`\n"
@@ -191,144 +193,56 @@ def sync_sheets(update: Update, context: CallbackContext):
     if update.effective_user.id != settings.SUPER_ADMIN_ID: return
 
     msg = update.message.reply_text("⏳ **Sinxronizatsiya boshlanmoqda...**\nMa'lumotlar tahlil qilinmoqda.", parse_mode='Markdown')
-    
-    db = SessionLocal()
-    manager = GoogleSheetManager()
-    
-    try:
-        raw_data = manager.get_all_employees_raw()
-        
-        if not raw_data:
-            msg.edit_text("❌ Sheet bo'sh yoki o'qib bo'lmadi (Loglarni tekshiring).")
-            return
-
-        all_employees = db.query(Employee).all()
-        
-        db_emp_by_id = {e.account_id: e for e in all_employees}
-        
-        db_emp_by_name = {(e.branch_id, normalize_text(e.full_name)): e for e in all_employees}
-
-        count_new = 0
-        count_updated = 0
-        count_generated = 0
-        count_recovered = 0 
-        not_found_branches = set()
-
-        updates_by_worksheet = {}
-
-        for worksheet, row_num, data in raw_data:
-            sheet_acc_id = data['account_id']
-            full_name = data['full_name']
-            b_name = data['branch_name']
-
-            branch = db.query(Branch).filter(Branch.name == b_name).first()
-            if not branch:
-                not_found_branches.add(b_name)
-                continue 
-
-            if worksheet not in updates_by_worksheet:
-                updates_by_worksheet[worksheet] = []
-
-            if sheet_acc_id:
-                if sheet_acc_id in db_emp_by_id:
-                    existing_emp = db_emp_by_id[sheet_acc_id]
-                    if existing_emp.full_name != full_name or existing_emp.branch_id != branch.id:
-                        existing_emp.full_name = full_name
-                        existing_emp.branch_id = branch.id
-                        count_updated += 1
-                else:
-                    new_emp = Employee(
-                        account_id=sheet_acc_id, 
-                        full_name=full_name, 
-                        branch_id=branch.id
-                    )
-                    db.add(new_emp)
-                    db_emp_by_id[sheet_acc_id] = new_emp
-                    count_new += 1
-
-            else:
-                key = (branch.id, normalize_text(full_name))
-                
-                if key in db_emp_by_name:
-                    existing_emp = db_emp_by_name[key]
-                    
-                    updates_by_worksheet[worksheet].append((row_num, existing_emp.account_id))
-                    count_recovered += 1
-                    
-                    if existing_emp.full_name != full_name:
-                        existing_emp.full_name = full_name
-                        count_updated += 1
-                else:
-                    new_id = generate_new_id()
-                    
-                    while db.query(Employee).filter(Employee.account_id == new_id).first():
-                        new_id = generate_new_id()
-                    
-                    updates_by_worksheet[worksheet].append((row_num, new_id))
-                    count_generated += 1
-                    
-                    new_emp = Employee(
-                        account_id=new_id, 
-                        full_name=full_name, 
-                        branch_id=branch.id
-                    )
-                    db.add(new_emp)
-                    
-                    db_emp_by_id[new_id] = new_emp
-                    db_emp_by_name[(branch.id, normalize_text(full_name))] = new_emp
-                    count_new += 1
-        
-        db.commit()
-
-        if count_generated > 0 or count_recovered > 0:
-            msg.edit_text("💾 **Google Sheetga IDlar yozilmoqda...**\n(Batch Update rejimi)", parse_mode='Markdown')
-            
-            for ws, updates in updates_by_worksheet.items():
-                if updates:
-                    manager.batch_update_ids(ws, updates)
-        
-        result_text = (
-            f"✅ **Jarayon yakunlandi!**\n\n"
-            f"🆕 Bazaga yangi qo'shildi: {count_new}\n"
-            f"🔄 Yangilandi: {count_updated}\n"
-            f"🆔 **Yangi ID berildi (Sheetga yozildi): {count_generated}**\n"
-            f"♻️ **Eski ID tiklandi (Sheetga yozildi): {count_recovered}**"
-        )
-        
-        if not_found_branches:
-            result_text += "\n\n⚠️ **Topilmagan filiallar:**\n" + ", ".join(not_found_branches)
-            result_text += "\n(Avval '➕ Filial qo'shish' orqali ularni yarating)"
-
-        msg.edit_text(result_text, parse_mode='Markdown')
+    context.dispatcher.run_async(_run_sync_sheets, msg)
 
+def _run_sync_sheets(msg):
+    try:
+        report = run_directory_sync(GoogleSheetManager(), incremental=False)
     except Exception as e:
         msg.edit_text(f"❌ Xatolik yuz berdi: {e}")
-    finally:
-        db.close()
+        return
+
+    if report is None:
+        msg.edit_text("⏳ Sinxronizatsiya hozir fon rejimida ketmoqda, birozdan so'ng qayta urinib ko'ring.")
+        return
+    if report.get("empty"):
+        msg.edit_text("❌ Sheet bo'sh yoki o'qib bo'lmadi (Loglarni tekshiring).")
+        return
+    invalidate_branch_stats()
+
+    result_text = (
+        f"✅ **Jarayon yakunlandi!**\n\n"
+        f"🆕 Bazaga yangi qo'shildi: {report['new']}\n"
+        f"🔄 Yangilandi: {report['updated']}\n"
+        f"🆔 **Yangi ID berildi (Sheetga yozildi): {report['generated']}**\n"
+        f"♻️ **Eski ID tiklandi (Sheetga yozildi): {report['recovered']}**"
+    )
+    
+    if report["not_found_branches"]:
+        result_text += "\n\n⚠️ **Topilmagan filiallar:**\n" + ", ".join(report["not_found_branches"])
+        result_text += "\n(Avval '➕ Filial qo'shish' orqali ularni yarating)"
+
+    msg.edit_text(result_text, parse_mode='Markdown')
 
 def list_info(update: Update, context: CallbackContext):
     if update.effective_user.id != settings.SUPER_ADMIN_ID: return
 
-    db = get_db()
-    branches = db.query(Branch).all()
+    stats = branch_stats()
     
-    if not branches:
+    if not stats:
         update.message.reply_text("📭 Tizimda ma'lumotlar yo'q.")
-        db.close()
         return
 
     text = "📊 **Tizim ma'lumotlari:**\n\n"
-    for b in branches:
-        dev_count = len(b.devices)
-        emp_count = len(b.employees)
+    for b in stats:
         text += (
-            f"🏢 **{b.name}**\n"
-            f"   - 🖥 Qurilmalar: {dev_count} ta\n"
-            f"   - 👥 Xodimlar: {emp_count} ta\n"
-            f"   - 📄 Sheet ID: `{b.attendance_sheet_id}`\n\n"
+            f"🏢 **{b['name']}**\n"
+            f"   - 🖥 Qurilmalar: {b['devices']} ta\n"
+            f"   - 👥 Xodimlar: {b['employees']} ta\n"
+            f"   - ✅ Bugun kelganlar: {b['present_today']} ta\n"
+            f"   - 📄 Sheet ID: `{b['sheet_id']}`\n\n"
         )
     
-    db.close()
     update.message.reply_text(text, parse_mode='Markdown')
 
 def set_notification_start(update: Update, context: CallbackContext):
@@ -383,6 +297,7 @@ def get_notif_chat_id(update: Update, context: CallbackContext):
         employee = db.query(Employee).filter(Employee.id == emp_db_id).first()
         employee.notification_chat_id = chat_id
         db.commit()
+        cache.set_employees([employee])
         
         update.message.reply_text(
             f"✅ **Muvaffaqiyatli bog'landi!**\n\n"
@@ -396,4 +311,111 @@ def get_notif_chat_id(update: Update, context: CallbackContext):
     finally:
         db.close()
         
-    return ConversationHandler.END
\ No newline at end of file
+    return ConversationHandler.END
+
+def bulk_import_start(update: Update, context: CallbackContext):
+    if update.effective_user.id != settings.SUPER_ADMIN_ID: return ConversationHandler.END
+
+    update.message.reply_text(
+        "📦 **Ommaviy rasm yuklash**\n\n"
+        "Xodimlar rasmlari joylangan ZIP arxivni yuboring.\n"
+        "Har bir fayl nomi xodim ID si bo'lishi kerak: `101.jpg`, `102.jpg` ...\n"
+        "(Telegram cheklovi: arxiv hajmi 20 MB gacha)",
+        reply_markup=keyboards.get_cancel_keyboard(),
+        parse_mode='Markdown'
+    )
+    return states.BULK_ZIP
+
+def get_bulk_zip(update: Update, context: CallbackContext):
+    document = update.message.document
+    if not document.file_name or not document.file_name.lower().endswith('.zip'):
+        update.message.reply_text("❌ Iltimos, .zip formatidagi arxiv yuboring.")
+        return states.BULK_ZIP
+
+    msg = update.message.reply_text(
+        "⏳ Arxiv qabul qilindi. Rasmlar qurilmalarga yuklanmoqda...\n(Tugagach shu xabar yangilanadi)",
+        reply_markup=keyboards.get_admin_keyboard()
+    )
+    context.dispatcher.run_async(_run_bulk_import, context.bot, document.file_id, msg)
+    return ConversationHandler.END
+
+def _run_bulk_import(bot, file_id, msg):
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
+    try:
+        bot.get_file(file_id).download(custom_path=path)
+        report = import_faces_from_zip(path)
+        msg.edit_text(_format_import_report(report), parse_mode='Markdown')
+    except zipfile.BadZipFile:
+        msg.edit_text("❌ Arxivni ochib bo'lmadi (ZIP fayl buzilgan).")
+    except Exception as e:
+        msg.edit_text(f"❌ Xatolik yuz berdi: {e}")
+    finally:
+        os.remove(path)
+
+def _format_import_report(report):
+    text = (
+        f"📦 **Ommaviy yuklash yakunlandi**\n\n"
+        f"🗂 Arxivdagi rasmlar: {report['files']}\n"
+        f"👥 Bazadan topilgan xodimlar: {report['matched']}\n"
+    )
+    for dev in report['devices']:
+        text += f"🖥 IP {dev['ip']}: ✅ {dev['ok']} ta"
+        if dev['failed']:
+            text += f", ❌ {len(dev['failed'])} ta"
+        text += "\n"
+
+    if report['unknown']:
+        sample = ", ".join(f"`{acc}`" for acc in report['unknown'][:20])
+        more = f" (+{len(report['unknown']) - 20})" if len(report['unknown']) > 20 else ""
+        text += f"\n⚠️ **Topilmagan IDlar:** {sample}{more}\n"
+    if report['bad_images']:
+        text += f"\n⚠️ O'qib bo'lmagan rasmlar: {len(report['bad_images'])} ta\n"
+    if report['no_devices']:
+        text += f"\n⚠️ Filialida qurilma yo'q xodimlar: {len(report['no_devices'])} ta\n"
+
+    failed = {acc: msg for dev in report['devices'] for acc, msg in dev['failed'].items()}
+    if failed:
+        sample = "\n".join(f"`{acc}`: `{msg}`" for acc, msg in list(failed.items())[:10])
+        text += f"\n❌ **Xatolar (namuna):**\n{sample}"
+    return text
+
+def reconcile_command(update: Update, context: CallbackContext):
+    """/reconcile <IP yoki filial nomi> — qurilmalarni baza bilan tenglashtiradi."""
+    if update.effective_user.id != settings.SUPER_ADMIN_ID: return
+
+    target = " ".join(context.args).strip()
+    if not target:
+        update.message.reply_text(
+            "ℹ️ Foydalanish: `/reconcile 192.168.1.64` yoki `/reconcile Filial nomi`",
+            parse_mode='Markdown'
+        )
+        return
+
+    db = get_db()
+    branch = db.query(Branch).filter(Branch.name == target).first()
+    branch_id = branch.id if branch else None
+    db.close()
+
+    msg = update.message.reply_text("⏳ Qurilmalar baza bilan solishtirilmoqda...")
+    context.dispatcher.run_async(_run_reconcile, msg, target, branch_id)
+
+def _run_reconcile(msg, target, branch_id):
+    try:
+        results = reconcile_branch(branch_id) if branch_id else reconcile_device_by_ip(target)
+    except Exception as e:
+        msg.edit_text(f"❌ Xatolik yuz berdi: {e}")
+        return
+
+    if not results:
+        msg.edit_text("❌ Bunday IP dagi qurilma yoki filial topilmadi.")
+        return
+
+    text = "🔁 **Sinxronizatsiya natijasi:**\n\n"
+    for res in results:
+        text += f"🖥 IP {res['ip']}: qurilmada {res['on_device']}, ➕ {res['added']}, ➖ {res['deleted']}\n"
+        if res['no_face']:
+            text += f"   📷 Rasmi yo'q (faqat yozuv): {res['no_face']} ta\n"
+        if res['errors']:
+            text += f"   ⚠️ Xatolar: {len(res['errors'])} ta (`{res['errors'][0]}`)\n"
+    msg.edit_text(text, parse_mode='Markdown')
@@ -2,9 +2,15 @@ from telegram import Update, ReplyKeyboardRemove
 from telegram.ext import CallbackContext, ConversationHandler
 from core.database import SessionLocal
 from core.models import Employee, Device
-from core.hik_device import upload_to_branch_devices
+from core.hik_device import submit_branch_upload
+from core.face_image import pick_photo_size, prepare_face_image
+from core.face_store import face_store, link_photos
 from bot import states
 import io
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 def handle_id(update: Update, context: CallbackContext):
     text = update.message.text.strip()
@@ -43,12 +49,17 @@ def handle_photo(update: Update, context: CallbackContext):
         update.message.reply_text("Sessiya eskirgan. ID ni qayta yuboring.")
         return ConversationHandler.END
 
-    msg = update.message.reply_text("⏳ Rasm qabul qilindi. Filialdagi barcha qurilmalarga yuklanmoqda...")
+    msg = update.message.reply_text("⏳ Rasm qabul qilindi. Filialdagi barcha qurilmalarga yuklanmoqda...\n(Natija shu xabarda ko'rinadi)")
 
-    photo_file = update.message.photo[-1].get_file()
+    photo_file = pick_photo_size(update.message.photo).get_file()
     f = io.BytesIO()
     photo_file.download(out=f)
-    image_bytes = f.getvalue()
+
+    try:
+        image_bytes = prepare_face_image(f.getvalue())
+    except Exception:
+        msg.edit_text("❌ Rasmni o'qib bo'lmadi. Iltimos, boshqa selfi yuboring.")
+        return states.WAITING_PHOTO
 
     db = SessionLocal()
     devices = db.query(Device).filter(Device.branch_id == branch_id).all()
@@ -61,21 +72,68 @@ def handle_photo(update: Update, context: CallbackContext):
     dev_list = [{'ip': d.ip_address, 'user': d.username, 'pass': d.password} for d in devices]
     db.close()
 
-    results = upload_to_branch_devices(dev_list, user_id, image_bytes)
+    progress = EnrollmentProgress(msg, user_id, image_bytes, len(dev_list))
+    for future in submit_branch_upload(dev_list, user_id, image_bytes):
+        future.add_done_callback(progress.on_done)
 
-    report = "📊 **Yuklash natijalari:**\n\n"
-    success_count = 0
-    
-    for res in results:
-        status = "✅ OK" if res['success'] else f"❌ Xato ({res['msg']})"
-        report += f"🖥 IP {res['ip']}: {status}\n"
-        if res['success']: success_count += 1
-    
-    if success_count == len(devices):
-        final_text = f"✅ **Muvaffaqiyatli!**\nRasm barcha {success_count} ta qurilmaga yuklandi."
-    else:
-        final_text = f"⚠️ **Qisman yuklandi.**\n\n{report}"
-
-    msg.edit_text(final_text, parse_mode='Markdown')
     context.user_data.clear()
-    return ConversationHandler.END
\ No newline at end of file
+    return ConversationHandler.END
+
+class EnrollmentProgress:
+    """
+    Har bir qurilma tugaganda holat xabarini yangilaydi (qurilma navbati oqimlarida chaqiriladi).
+    Rasm yuz omboriga birinchi qurilma qabul qilganda yoziladi.
+    """
+    def __init__(self, msg, user_id, image_bytes, total):
+        self.msg = msg
+        self.user_id = user_id
+        self.image_bytes = image_bytes
+        self.photo_hash = None
+        self.total = total
+        self.results = []
+        self.lock = threading.Lock()
+
+    def on_done(self, future):
+        try:
+            res = future.result()
+        except Exception as e:
+            res = {"ip": "?", "success": False, "msg": f"System Error: {e}"}
+
+        with self.lock:
+            self.results.append(res)
+            try:
+                if res['success'] and self.photo_hash is None:
+                    self.photo_hash = face_store.put(self.image_bytes)
+                if len(self.results) < self.total:
+                    self.msg.edit_text(self._progress_text(), parse_mode='Markdown')
+                else:
+                    self._finish()
+            except Exception as e:
+                logger.error(f"Holat xabarini yangilashda xato: {e}")
+
+    def _report(self):
+        report = ""
+        for res in self.results:
+            status = "✅ OK" if res['success'] else f"❌ Xato ({res['msg']})"
+            report += f"🖥 IP {res['ip']}: {status}\n"
+        return report
+
+    def _progress_text(self):
+        return f"⏳ **Yuklanmoqda: {len(self.results)}/{self.total}**\n\n{self._report()}"
+
+    def _finish(self):
+        success_count = sum(1 for res in self.results if res['success'])
+
+        if self.photo_hash is not None:
+            db = SessionLocal()
+            try:
+                link_photos(db, {self.user_id: self.photo_hash})
+            finally:
+                db.close()
+
+        if success_count == self.total:
+            final_text = f"✅ **Muvaffaqiyatli!**\nRasm barcha {success_count} ta qurilmaga yuklandi."
+        else:
+            final_text = f"⚠️ **Qisman yuklandi.**\n\n📊 **Yuklash natijalari:**\n\n{self._report()}"
+
+        self.msg.edit_text(final_text, parse_mode='Markdown')
@@ -4,7 +4,7 @@ def get_admin_keyboard():
     keyboard = [
         ["➕ Filial qo'shish", "➕ Qurilma qo'shish"],
         ["🔔 Bildirishnoma ulash", "🔄 Google Sheets Sync"], 
-        ["📋 Ma'lumotlar"],
+        ["📦 Rasmlar (ZIP)", "📋 Ma'lumotlar"],
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
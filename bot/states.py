@@ -4,4 +4,6 @@
 
 (WAITING_PHOTO,) = range(7, 8)
 
-(NOTIF_EMP_ID, NOTIF_CHAT_ID) = range(8, 10)
\ No newline at end of file
+(NOTIF_EMP_ID, NOTIF_CHAT_ID) = range(8, 10)
+
+(BULK_ZIP,) = range(10, 11)
\ No newline at end of file
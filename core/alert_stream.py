@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from .config import settings
+from .database import SessionLocal
+from .models import Device
+from .hik_device import _get_session
+from .metrics import DEVICE_ERRORS
+from .multipart import MultipartStreamParser, boundary_from, is_event_part, parse_event_part
+
+logger = logging.getLogger(__name__)
+
+ALERT_STREAM_PATH = "/ISAPI/Event/notification/alertStream"
+
+
+class AlertStreamConsumer:
+    """
+    Har bir ro'yxatdagi qurilmaga doimiy alertStream ulanishini ushlab turadi
+    (NAT ortidagi yoki push navbati to'xtab qoladigan qurilmalar uchun).
+    Hodisalar receive_event bilan bir xil yo'lga (handler) uzatiladi.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, handler: Callable,
+                 scheme: str = None, on_connect: Callable = None):
+        self.loop = loop
+        self.handler = handler
+        self.scheme = scheme or settings.ALERT_STREAM_SCHEME
+        self.on_connect = on_connect
+
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refresher = None
+
+    def start(self):
+        self._stopped.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="alert-stream-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            for stop_event, _ in self._workers.values():
+                stop_event.set()
+            self._workers.clear()
+
+    def _refresh_loop(self):
+        """Yangi qo'shilgan yoki o'chirilgan qurilmalarni vaqti-vaqti bilan hisobga oladi."""
+        while not self._stopped.is_set():
+            try:
+                self.sync_devices(self._load_devices())
+            except Exception as e:
+                logger.error(f"alertStream qurilmalar ro'yxati xatosi: {e}")
+            self._stopped.wait(settings.ALERT_STREAM_REFRESH_INTERVAL)
+
+    def _load_devices(self) -> Dict[tuple, dict]:
+        db = SessionLocal()
+        try:
+            devices = db.query(Device).all()
+            return {
+                (d.ip_address, d.username, d.password): {'ip': d.ip_address, 'user': d.username, 'pass': d.password}
+                for d in devices
+            }
+        finally:
+            db.close()
+
+    def sync_devices(self, devices: Dict[tuple, dict]):
+        with self._lock:
+            for key in list(self._workers):
+                if key not in devices:
+                    self._workers.pop(key)[0].set()
+            for key, device in devices.items():
+                if key in self._workers: continue
+                stop_event = threading.Event()
+                thread = threading.Thread(
+                    target=self._consume, args=(device, stop_event),
+                    name=f"alert-stream-{device['ip']}", daemon=True
+                )
+                self._workers[key] = (stop_event, thread)
+                thread.start()
+
+    def _consume(self, device: dict, stop_event: threading.Event):
+        url = f"{self.scheme}://{device['ip']}{ALERT_STREAM_PATH}"
+        session = _get_session(device['ip'], device['user'], device['pass'])
+        backoff = 1
+
+        while not stop_event.is_set():
+            try:
+                with session.get(url, stream=True, timeout=(5, settings.ALERT_STREAM_READ_TIMEOUT)) as resp:
+                    resp.raise_for_status()
+                    boundary = boundary_from(resp.headers.get("content-type", ""))
+                    if not boundary:
+                        raise ValueError(f"multipart boundary topilmadi: {resp.headers.get('content-type')}")
+
+                    logger.info(f"📡 alertStream ulandi: {device['ip']}")
+                    backoff = 1
+                    if self.on_connect:
+                        self.on_connect(device)
+
+                    parser = MultipartStreamParser(boundary, keep=is_event_part)
+                    for chunk in resp.iter_content(chunk_size=8192):
+                        if stop_event.is_set(): return
+                        for headers, body in parser.feed(chunk):
+                            self._dispatch(device, parse_event_part(headers, body))
+            except Exception as e:
+                if stop_event.is_set(): return
+                DEVICE_ERRORS.labels(device['ip'], "alert_stream").inc()
+                logger.warning(f"alertStream uzildi ({device['ip']}): {e}. {backoff}s dan keyin qayta ulanadi")
+
+            stop_event.wait(backoff)
+            backoff = min(backoff * 2, settings.ALERT_STREAM_MAX_BACKOFF)
+
+    def _dispatch(self, device: dict, data: Optional[dict]):
+        if not data or data.get("eventType") != "AccessControllerEvent":
+            return
+        # NAT ortida terminal o'zining LAN manzilini yuboradi; qurilma ulanish manzili bilan aniqlanadi
+        data["ipAddress"] = device['ip']
+        future = asyncio.run_coroutine_threadsafe(self.handler(data), self.loop)
+        try:
+            future.result(timeout=30)
+        except Exception as e:
+            logger.error(f"alertStream hodisasini qayta ishlashda xato ({device['ip']}): {e}")
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import cache
+from .config import settings
+from .database import SessionLocal
+from .models import Device, DeviceEventCursor, AttendanceOutbox
+from .hik_device import HikDeviceClient, device_jobs
+from .metrics import DEVICE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+UZ_TZ = timezone(timedelta(hours=5))
+
+
+def _device_time(value: datetime) -> str:
+    return value.astimezone(UZ_TZ).replace(microsecond=0).isoformat()
+
+
+def _parse_device_time(value: str) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=UZ_TZ)
+
+
+def _epoch_ms(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+
+def event_payload(device_ip: str, info: dict) -> dict:
+    """AcsEvent yozuvini push hodisasi ko'rinishiga keltiradi (process_event kutgan format)."""
+    return {
+        "eventType": "AccessControllerEvent",
+        "ipAddress": device_ip,
+        "AccessControllerEvent": {
+            "employeeNoString": info.get("employeeNoString"),
+            "subEventType": info.get("minor"),
+            "serialNo": info.get("serialNo"),
+        },
+    }
+
+
+def _save_cursor(device_ip: str, serial_no, event_time: datetime):
+    db = SessionLocal()
+    try:
+        stmt = insert(DeviceEventCursor).values(
+            device_ip=device_ip, last_serial_no=serial_no, last_event_time=event_time
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[DeviceEventCursor.device_ip],
+            set_={"last_serial_no": stmt.excluded.last_serial_no, "last_event_time": stmt.excluded.last_event_time},
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _known_serials(device_ip: str, serials, since: datetime) -> set:
+    """Jonli push orqali allaqachon navbatga tushgan hodisalar (since dan keyingi)."""
+    if not serials: return set()
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(AttendanceOutbox.device_serial)
+            .where(
+                AttendanceOutbox.device_ip == device_ip,
+                AttendanceOutbox.device_serial.in_(list(serials)),
+                AttendanceOutbox.event_time >= since,
+            )
+        )
+        return {row[0] for row in rows}
+    finally:
+        db.close()
+
+
+class EventBackfiller:
+    """
+    Server ishlamay yoki qurilmaga yetib bo'lmay qolgan paytda yo'qolgan hodisalarni
+    qurilmaning AcsEvent tarixidan o'qib, oddiy yo'l (handler) orqali qayta ishlaydi.
+    Har bir qurilma uchun oxirgi ko'rilgan serialNo va vaqt device_event_cursors da saqlanadi.
+    Jonli yo'l qayta ishlagan hodisalar (navbatga yozilmaganlari ham) seen:{ip} orqali o'tkazib yuboriladi.
+    handler(data, event_time) — uvicorn event loopidagi korutina.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, handler: Callable):
+        self.loop = loop
+        self.handler = handler
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="event-backfill", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.backfill_all()
+            except Exception as e:
+                logger.error(f"Backfill xatosi: {e}")
+            self._stopped.wait(settings.BACKFILL_INTERVAL)
+
+    def backfill_all(self):
+        db = SessionLocal()
+        try:
+            devices = [{'ip': d.ip_address, 'user': d.username, 'pass': d.password} for d in db.query(Device).all()]
+        finally:
+            db.close()
+        for device in devices:
+            self.trigger(device)
+
+    def trigger(self, device: dict):
+        """Qurilma navbatiga qo'yadi; shu qurilma uchun backfill ketayotgan bo'lsa o'tkazib yuboriladi."""
+        with self._running_lock:
+            if device['ip'] in self._running: return
+            self._running.add(device['ip'])
+        device_jobs.submit(device['ip'], self._backfill_guarded, device)
+
+    def _backfill_guarded(self, device: dict):
+        try:
+            return self.backfill_device(device)
+        except Exception as e:
+            DEVICE_ERRORS.labels(device['ip'], "backfill").inc()
+            logger.warning(f"Backfill bajarilmadi ({device['ip']}): {e}")
+        finally:
+            with self._running_lock:
+                self._running.discard(device['ip'])
+
+    def backfill_device(self, device: dict) -> int:
+        """Kursordan keyingi hodisalarni qayta ishlaydi. Navbatga yuborilganlar sonini qaytaradi."""
+        ip = device['ip']
+        now = datetime.now(timezone.utc)
+
+        db = SessionLocal()
+        try:
+            cursor = db.get(DeviceEventCursor, ip)
+        finally:
+            db.close()
+
+        if cursor is None:
+            # Yangi qurilma: kuzatuv shu paytdan boshlanadi, eski tarix qayta yuborilmaydi
+            _save_cursor(ip, None, now)
+            return 0
+
+        start = max(
+            cursor.last_event_time - timedelta(seconds=settings.BACKFILL_OVERLAP_SECONDS),
+            now - timedelta(hours=settings.BACKFILL_MAX_LOOKBACK_HOURS),
+        )
+        client = HikDeviceClient(ip, device['user'], device['pass'])
+
+        history = []
+        for info in client.search_events(_device_time(start), _device_time(now)):
+            serial_no = info.get("serialNo")
+            event_time = _parse_device_time(info.get("time"))
+            if serial_no is None or event_time is None: continue
+            history.append((serial_no, event_time, info))
+
+        # Qurilma qayta yuklansa serialNo boshidan boshlanadi: kursordan keyingi vaqtdagi
+        # hodisaning raqami kursordan kichik bo'ladi. Bunda vaqt bo'yicha filtrlanadi.
+        reset = cursor.last_serial_no is not None and any(
+            event_time > cursor.last_event_time and serial_no <= cursor.last_serial_no
+            for serial_no, event_time, _ in history
+        )
+        if reset or cursor.last_serial_no is None:
+            events = [e for e in history if e[1] > cursor.last_event_time]
+        else:
+            events = [e for e in history if e[0] > cursor.last_serial_no]
+
+        if not events:
+            return 0
+        # Qayta yuklanishdan oldingi va keyingi raqamlar aralashgan bo'lsa, tartib vaqt bo'yicha
+        events.sort(key=(lambda e: (e[1], e[0])) if reset else (lambda e: e[0]))
+        serials = [serial_no for serial_no, _, _ in events]
+        if reset:
+            logger.warning(f"{ip}: serialNo qayta boshlangan ({cursor.last_serial_no} -> {serials[0]}), vaqt bo'yicha tiklanadi")
+        # seen:{ip} dagi yozuv hodisa vaqti bilan solishtiriladi: qayta yuklanishdan oldingi shu raqam hisobga olinmaydi
+        known = (
+            _known_serials(ip, serials, cursor.last_event_time if reset else start)
+            | cache.known_serials(ip, {serial_no: _epoch_ms(event_time) for serial_no, event_time, _ in events})
+        )
+
+        sent = 0
+        # Qayta boshlangan qurilmaning kursori eski raqamni saqlamaydi
+        last_serial = None if reset else cursor.last_serial_no
+        last_time = cursor.last_event_time
+        for serial_no, event_time, info in events:
+            if serial_no not in known and info.get("employeeNoString"):
+                future = asyncio.run_coroutine_threadsafe(self.handler(event_payload(ip, info), event_time), self.loop)
+                try:
+                    future.result(timeout=30)
+                except Exception as e:
+                    # Kursor shu hodisadan oldin to'xtaydi, keyingi safar davom ettiriladi
+                    logger.error(f"Backfill to'xtadi ({ip}, serial {serial_no}): {e}")
+                    break
+                sent += 1
+            last_serial, last_time = serial_no, event_time
+
+        _save_cursor(ip, last_serial, last_time)
+        cache.trim_seen(ip, _epoch_ms(last_time))
+        if sent:
+            logger.info(f"⏪ {ip}: tarixdan {sent} ta hodisa tiklandi")
+        return sent
@@ -0,0 +1,152 @@
+import logging
+import os
+import tempfile
+import zipfile
+from collections import defaultdict
+from typing import Dict, List
+
+from .database import SessionLocal
+from .models import Employee, Device
+from .hik_device import HikDeviceClient, device_jobs
+from .face_image import prepare_face_image
+from .face_store import FaceStore, face_store, link_photos
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg"}
+ENROLL_CHUNK = 20
+
+
+def _account_id_from_name(name: str):
+    base = os.path.basename(name)
+    if not base or name.startswith("__MACOSX/") or base.startswith("."):
+        return None
+    stem, ext = os.path.splitext(base)
+    if ext.lower() not in IMAGE_EXTENSIONS:
+        return None
+    return stem.strip() or None
+
+
+def scan_archive(zip_path: str) -> Dict[str, str]:
+    """
+    Arxivdagi <account_id>.jpg fayllarni topadi (faqat markaziy katalog o'qiladi).
+    {account_id: arxiv ichidagi nom} qaytaradi.
+    """
+    members = {}
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir(): continue
+            account_id = _account_id_from_name(info.filename)
+            if account_id:
+                members[account_id] = info.filename
+    return members
+
+
+def _prepare_images(zip_path: str, members: Dict[str, str], staging: FaceStore):
+    """
+    Har bir rasmni bir marta (qurilmalar sonidan qat'i nazar) qurilma cheklovlariga moslaydi
+    va vaqtinchalik omborga yozadi. {account_id: xesh} va {account_id: xato} qaytaradi.
+    """
+    digests, failed = {}, {}
+    with zipfile.ZipFile(zip_path) as archive:
+        for account_id, member in members.items():
+            try:
+                image_bytes = prepare_face_image(archive.read(member))
+            except Exception as e:
+                failed[account_id] = f"Rasmni o'qib bo'lmadi: {e}"
+                continue
+            digests[account_id] = staging.put(image_bytes)
+    return digests, failed
+
+
+def _enroll_device(device: dict, users: List[tuple], staging: FaceStore):
+    """Bitta qurilmaga partiyalab yozadi. Rasmlar vaqtinchalik ombordan navbat bilan o'qiladi."""
+    client = HikDeviceClient(device['ip'], device['user'], device['pass'])
+    ok, failed, enrolled = 0, {}, []
+    for start in range(0, len(users), ENROLL_CHUNK):
+        # Xodimlarning selfilari butun import tugashini kutmaydi
+        device_jobs.run_priority(device['ip'])
+        chunk = users[start:start + ENROLL_CHUNK]
+        batch = [(account_id, staging.get(digest)) for account_id, digest in chunk]
+        try:
+            results = client.enroll_many(batch)
+        except Exception as e:
+            results = {account_id: (False, f"System Error: {e}") for account_id, _ in chunk}
+        for account_id, (success, msg) in results.items():
+            if success:
+                ok += 1
+                enrolled.append(account_id)
+            else:
+                failed[account_id] = msg
+    return {"ip": device['ip'], "ok": ok, "failed": failed, "enrolled": enrolled}
+
+
+def import_faces_from_zip(zip_path: str) -> dict:
+    """
+    ZIP arxivdagi yuz rasmlarini xodimlarning filialidagi barcha qurilmalarga yuklaydi.
+    Xodimlar va qurilmalar bittadan so'rov bilan olinadi, qurilmalarga parallel yuboriladi.
+    """
+    members = scan_archive(zip_path)
+    report = {"files": len(members), "matched": 0, "unknown": [], "bad_images": {}, "devices": [], "no_devices": []}
+    if not members:
+        return report
+
+    db = SessionLocal()
+    try:
+        employees = (
+            db.query(Employee.account_id, Employee.branch_id)
+            .filter(Employee.account_id.in_(list(members)))
+            .all()
+        )
+        branch_ids = {e.branch_id for e in employees}
+        devices = db.query(Device).filter(Device.branch_id.in_(branch_ids)).all() if branch_ids else []
+        devices = [{'ip': d.ip_address, 'user': d.username, 'pass': d.password, 'branch_id': d.branch_id} for d in devices]
+    finally:
+        db.close()
+
+    known = {e.account_id for e in employees}
+    report["matched"] = len(known)
+    report["unknown"] = sorted(set(members) - known)
+
+    branches_with_devices = {d['branch_id'] for d in devices}
+    report["no_devices"] = [e.account_id for e in employees if e.branch_id not in branches_with_devices]
+
+    if not devices:
+        return report
+
+    to_prepare = {e.account_id: members[e.account_id] for e in employees if e.branch_id in branches_with_devices}
+
+    # Tayyorlangan rasmlar avval vaqtinchalik papkaga yoziladi; yuz omboriga faqat
+    # kamida bitta qurilma qabul qilganlari ko'chiriladi, qolganlari papka bilan o'chadi
+    with tempfile.TemporaryDirectory(prefix="faces-") as tmp_dir:
+        staging = FaceStore(tmp_dir)
+        digests, report["bad_images"] = _prepare_images(zip_path, to_prepare, staging)
+
+        users_by_branch = defaultdict(list)
+        for e in employees:
+            if e.account_id in digests:
+                users_by_branch[e.branch_id].append((e.account_id, digests[e.account_id]))
+
+        # Qurilma navbati orqali: shu terminalga boshqa yuklashlar bilan bir vaqtda so'rov yuborilmaydi
+        futures = [
+            device_jobs.submit(device['ip'], _enroll_device, device, users_by_branch[device['branch_id']], staging)
+            for device in devices
+        ]
+        for future in futures:
+            try:
+                report["devices"].append(future.result())
+            except Exception as e:
+                logger.error(f"Ommaviy yuklashda xato: {e}")
+
+        # Kamida bitta qurilma qabul qilgan rasmlar omborga yoziladi va xodimga bog'lanadi
+        accepted = {acc for dev in report["devices"] for acc in dev["enrolled"]}
+        for digest in {digests[acc] for acc in accepted}:
+            face_store.put(staging.get(digest))
+
+    db = SessionLocal()
+    try:
+        link_photos(db, {acc: digests[acc] for acc in accepted})
+    finally:
+        db.close()
+
+    return report
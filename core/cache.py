@@ -1,11 +1,74 @@
+import asyncio
 import json
 import redis
+import redis.asyncio as aioredis
 import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
 from core.config import settings
 from core.models import Device, Employee, Branch
+from core.metrics import cache_lookup
 
 logger = logging.getLogger(__name__)
 
+STATE_TTL = 64800
+
+def state_value(action: str, event_ms: int) -> str:
+    """state:{id} qiymati: oxirgi action va uni o'rnatgan hodisa vaqti (ms)."""
+    return f"{action}|{event_ms}"
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+class LocalTTLCache:
+    """Jarayon ichidagi chegaralangan TTL/LRU kesh (Redisdan oldingi L1 qatlam)."""
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+def device_payload(device: Device, branch: Branch) -> dict:
+    return {
+        "device_type": device.device_type.value,
+        "branch_id": branch.id,
+        "branch_name": branch.name,
+        "sheet_id": branch.attendance_sheet_id
+    }
+
+def employee_payload(employee: Employee) -> dict:
+    return {
+        "full_name": employee.full_name,
+        "chat_id": employee.notification_chat_id
+    }
+
 class CacheManager:
     def __init__(self):
         try:
@@ -22,70 +85,406 @@ class CacheManager:
             logger.error(f"❌ Redisga ulanishda xatolik: {e}")
             self.redis = None
 
-        self.TTL = 3600  
-
-    def get_device_info(self, ip: str):
-        if not self.redis: return None
-        try:
-            key = f"device:{ip}"
-            data = self.redis.get(key)
-            if data: return json.loads(data)
-        except Exception as e:
-            logger.error(f"Redis get_device error: {e}")
-        return None
+        self.TTL = settings.CACHE_TTL
 
     def set_device_info(self, device: Device, branch: Branch):
         if not self.redis: return
         try:
             key = f"device:{device.ip_address}"
-            data = {
-                "device_type": device.device_type.value,
-                "branch_id": branch.id,
-                "branch_name": branch.name,
-                "sheet_id": branch.attendance_sheet_id
-            }
+            data = device_payload(device, branch)
             self.redis.set(key, json.dumps(data), ex=self.TTL)
         except Exception as e:
             logger.error(f"Redis set_device error: {e}")
 
-    def get_employee_info(self, emp_id: str):
-        if not self.redis: return None
-        try:
-            key = f"emp:{emp_id}"
-            data = self.redis.get(key)
-            if data: return json.loads(data)
-        except Exception as e:
-            logger.error(f"Redis get_employee error: {e}")
-        return None
-
     def set_employee_info(self, employee: Employee):
         if not self.redis: return
         try:
             key = f"emp:{employee.account_id}"
-            data = {
-                "full_name": employee.full_name,
-                "chat_id": employee.notification_chat_id
-            }
+            data = employee_payload(employee)
             self.redis.set(key, json.dumps(data), ex=self.TTL)
         except Exception as e:
             logger.error(f"Redis set_employee error: {e}")
-    def check_action_state(self, emp_id: str, new_action: str) -> bool:
 
-        if not self.redis: return True 
+    def _set_many(self, items, publish: bool):
+        """(kalit, dict) juftliklarini pipeline bilan yozadi; publish=True bo'lsa L1 keshlarga xabar beradi."""
+        if not self.redis or not items: return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for i, (key, value) in enumerate(items, 1):
+                pipe.set(key, json.dumps(value), ex=self.TTL)
+                if publish:
+                    pipe.publish(INVALIDATION_CHANNEL, key)
+                if i % 1000 == 0:
+                    pipe.execute()
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis pipeline set error: {e}")
+
+    def set_devices(self, devices, publish: bool = True):
+        """devices: (Device, Branch) juftliklari."""
+        self._set_many([(f"device:{d.ip_address}", device_payload(d, b)) for d, b in devices], publish)
+
+    def set_employees(self, employees, publish: bool = True):
+        self._set_many([(f"emp:{e.account_id}", employee_payload(e)) for e in employees], publish)
+
+    def warm_up(self, db):
+        """Barcha qurilma va xodimlarni Redisga oldindan yuklaydi (deploy yoki Redis restartidan keyin)."""
+        if not self.redis: return
+        try:
+            devices = db.query(Device, Branch).join(Branch, Branch.id == Device.branch_id).all()
+            employees = db.query(Employee.account_id, Employee.full_name, Employee.notification_chat_id).all()
+            self.set_devices(devices, publish=False)
+            self.set_employees(employees, publish=False)
+            logger.info(f"🔥 Kesh isitildi: {len(devices)} qurilma, {len(employees)} xodim")
+        except Exception as e:
+            logger.error(f"Kesh isitishda xato: {e}")
 
+    def _invalidate(self, keys):
+        if not self.redis or not keys: return
         try:
-            key = f"state:{emp_id}" 
-            
-            last_action = self.redis.get(key) 
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.delete(*keys)
+            for key in keys:
+                pipe.publish(INVALIDATION_CHANNEL, key)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis invalidate error: {e}")
+
+    def invalidate_device(self, ip: str):
+        """Qurilma o'zgarganda Redis va barcha jarayonlardagi L1 keshdan o'chiradi."""
+        self._invalidate([f"device:{ip}"])
 
-            if last_action == new_action:
-                return False
+    def invalidate_employees(self, emp_ids):
+        self._invalidate([f"emp:{emp_id}" for emp_id in emp_ids])
+
+    def known_serials(self, ip: str, events: dict) -> set:
+        """
+        seen:{ip} da bor (jonli yo'l qayta ishlagan, e'tiborsiz qoldirilganlari ham) serialNo lar.
+        events: {serialNo: hodisa vaqti (ms)}; qayta yuklanishdan oldingi shu raqamli hodisa hisobga olinmaydi.
+        """
+        serials = list(events)
+        if not self.redis or not serials: return set()
+        try:
+            scores = self.redis.zmscore(f"seen:{ip}", serials)
+            return {
+                serial for serial, score in zip(serials, scores)
+                if score is not None and abs(events[serial] - score) < SERIAL_REUSE_MS
+            }
+        except Exception as e:
+            logger.error(f"Redis known serials error: {e}")
+            return set()
 
-            self.redis.set(key, new_action, ex=64800)
-            
-            return True
+    def trim_seen(self, ip: str, up_to_ms: int):
+        """Backfill kursori (hodisa vaqti, ms) o'tgan serialNo larni seen:{ip} dan bo'shatadi."""
+        if not self.redis: return
+        try:
+            self.redis.eval(TRIM_SEEN_LUA, 1, f"seen:{ip}", up_to_ms, settings.DEDUP_SERIALS_PER_DEVICE)
         except Exception as e:
-            logger.error(f"Redis state check error: {e}")
-            return True 
+            logger.error(f"Redis seen trim error: {e}")
+
+RESOLVE_UNAVAILABLE = 0
+RESOLVE_OK = 1
+RESOLVE_DUPLICATE = 2
+RESOLVE_DEVICE_MISS = 3
+RESOLVE_REPEATED = 4
+
+# Bir xil serialNo ning shu vaqtdan ko'p farq qiladigan hodisasi qayta yuborilgan push emas
+SERIAL_REUSE_MS = 600000
+
+# Bitta jismoniy o'tishni bir marta qayta ishlash uchun umumiy bosqich:
+# 1) qurilma serialNo si shu qurilmaning oxirgi seen_max ta hodisasi ichida bo'lsa — qayta yuborilgan push.
+#    seen:{ip} hodisa vaqti bo'yicha tartiblanadi (eng eskisi chiqariladi). Qurilma qayta yuklanib
+#    serialNo boshidan boshlansa, eski yozuvdagi vaqt SERIAL_REUSE_MS dan ko'p farq qiladi — bu takror emas;
+# 2) xodimning oxirgi o'tishidan window_ms dan kam vaqt o'tgan bo'lsa — boshqa o'quvchidagi ikkinchi o'qish.
+# Vaqt hodisa vaqti bo'yicha solishtiriladi, shuning uchun tarixdan tiklangan hodisalar ham to'g'ri ajraladi.
+# Ikkinchi qiymat — pass:{id} ning oldingi qiymati (navbatga yozilmasa tiklash uchun).
+DEDUP_LUA = f"""
+local SERIAL_REUSE_MS = {SERIAL_REUSE_MS}
+local function is_repeated(seen_key, pass_key, serial, event_ms_raw, window_ms, seen_max, ttl)
+    local previous = redis.call('GET', pass_key) or ''
+    local event_ms = tonumber(event_ms_raw)
+    if serial ~= '' then
+        local seen_ms = tonumber(redis.call('ZSCORE', seen_key, serial))
+        if seen_ms and math.abs(event_ms - seen_ms) < SERIAL_REUSE_MS then
+            return true, previous
+        end
+        redis.call('ZADD', seen_key, event_ms, serial)
+        redis.call('ZREMRANGEBYRANK', seen_key, 0, -seen_max - 1)
+        redis.call('EXPIRE', seen_key, ttl)
+    end
+    if window_ms > 0 then
+        local last = tonumber(previous)
+        if last and math.abs(event_ms - last) < window_ms then
+            return true, previous
+        end
+        if not last or event_ms > last then
+            redis.call('SET', pass_key, event_ms_raw, 'PX', window_ms)
+        end
+    end
+    return false, previous
+end
+"""
+
+# state:{id} = "ACTION|hodisa_ms" (eski yozuvlarda faqat ACTION, vaqti 0 deb olinadi).
+# Holatni o'rnatgan hodisadan eskiroq hodisa (tarixdan tiklangan) holatni o'zgartirmaydi
+# va dublikat deb ham hisoblanmaydi. Natija: kod (1 — o'tdi, 2 — dublikat) va oldingi qiymat.
+STATE_LUA = """
+local function apply_state(state_key, action, event_ms_raw, ttl)
+    local previous = redis.call('GET', state_key) or ''
+    if action ~= 'KIRISH' and action ~= 'CHIQISH' then
+        return 1, previous
+    end
+    local last_action, last_ms = string.match(previous, '^([^|]*)|?(%d*)$')
+    if tonumber(event_ms_raw) < (tonumber(last_ms) or 0) then
+        return 1, previous
+    end
+    if last_action == action then
+        return 2, previous
+    end
+    redis.call('SET', state_key, action .. '|' .. event_ms_raw, 'EX', ttl)
+    return 1, previous
+end
+"""
+
+# KEYS: device:{ip}, emp:{id}, state:{id}, seen:{ip}, pass:{id}
+# ARGV: qurilma universal bo'lsa ishlatiladigan action, state TTL, serialNo, hodisa vaqti (ms), oyna (ms), seen_max
+# Natija: {kod, qurilma, xodim, action, oldingi state, oldingi pass}
+RESOLVE_EVENT_LUA = DEDUP_LUA + STATE_LUA + """
+local device = redis.call('GET', KEYS[1])
+if not device then
+    return {3, '', '', '', '', ''}
+end
+local employee = redis.call('GET', KEYS[2]) or ''
+
+local action = ARGV[1]
+local device_type = cjson.decode(device)['device_type']
+if device_type == 'entry' then
+    action = 'KIRISH'
+elseif device_type == 'exit' then
+    action = 'CHIQISH'
+end
+
+local repeated, previous_pass = is_repeated(KEYS[4], KEYS[5], ARGV[3], ARGV[4], tonumber(ARGV[5]), tonumber(ARGV[6]), ARGV[2])
+if repeated then
+    return {4, device, employee, action, '', previous_pass}
+end
+
+local code, previous_state = apply_state(KEYS[3], action, ARGV[4], ARGV[2])
+return {code, device, employee, action, previous_state, previous_pass}
+"""
+
+# KEYS: state:{id}, seen:{ip}, pass:{id}
+# ARGV: action, state TTL, serialNo, hodisa vaqti (ms), oyna (ms), seen_max
+# Natija: {kod, oldingi state, oldingi pass}
+CHECK_EVENT_LUA = DEDUP_LUA + STATE_LUA + """
+local repeated, previous_pass = is_repeated(KEYS[2], KEYS[3], ARGV[3], ARGV[4], tonumber(ARGV[5]), tonumber(ARGV[6]), ARGV[2])
+if repeated then
+    return {4, '', previous_pass}
+end
+local code, previous_state = apply_state(KEYS[1], ARGV[1], ARGV[4], ARGV[2])
+return {code, previous_state, previous_pass}
+"""
+
+# Kursor vaqtigacha (ARGV[1], ms) bo'lgan serialNo larni o'chiradi, lekin eng yangi ARGV[2] tasini
+# jonli push takrorlarini aniqlash uchun qoldiradi. KEYS: seen:{ip}
+TRIM_SEEN_LUA = """
+local old = redis.call('ZCOUNT', KEYS[1], '-inf', ARGV[1])
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[2])
+local count = math.min(old, excess)
+if count > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, count - 1)
+end
+return math.max(count, 0)
+"""
+
+# Navbatga yozilmagan hodisa o'zgartirgan kalitlarni oldingi qiymatiga qaytaradi (CAS):
+# kalit hali ham shu hodisa yozgan qiymatni saqlasa tiklanadi, aks holda keyingi hodisaga tegilmaydi.
+# KEYS: tiklanadigan kalitlar
+# ARGV: har bir kalit uchun uchlik — yozilgan qiymat, oldingi qiymat ('' — kalit yo'q edi), TTL (ms)
+RESTORE_STATE_LUA = """
+for i, key in ipairs(KEYS) do
+    local written, previous, ttl = ARGV[i * 3 - 2], ARGV[i * 3 - 1], ARGV[i * 3]
+    if redis.call('GET', key) == written then
+        if previous == '' then
+            redis.call('DEL', key)
+        else
+            redis.call('SET', key, previous, 'PX', ttl)
+        end
+    end
+end
+return 1
+"""
+
+def _action_for(device: dict, fallback_action: str) -> str:
+    """RESOLVE_EVENT_LUA dagi qoidaning Python nusxasi."""
+    if device.get('device_type') == 'entry': return "KIRISH"
+    if device.get('device_type') == 'exit': return "CHIQISH"
+    return fallback_action
+
+class EventResolution(NamedTuple):
+    code: int
+    device: Optional[dict] = None
+    employee: Optional[dict] = None
+    action: Optional[str] = None
+    # Skript ustidan yozgan kalitlarning oldingi qiymatlari ('' — kalit yo'q edi)
+    previous_state: str = ""
+    previous_pass: str = ""
+
+class AsyncCacheManager:
+    """
+    CacheManager ning redis.asyncio varianti. FastAPI ingest yo'lida ishlatiladi,
+    shuning uchun sekin Redis javobi boshqa qurilmalarning so'rovlarini to'xtatmaydi.
+    """
+    def __init__(self):
+        self.redis = aioredis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=0,
+            decode_responses=True,
+            socket_timeout=2,
+            socket_connect_timeout=2
+        )
+        self.TTL = settings.CACHE_TTL
+        self._resolve_script = self.redis.register_script(RESOLVE_EVENT_LUA)
+        self._event_script = self.redis.register_script(CHECK_EVENT_LUA)
+        self._restore_script = self.redis.register_script(RESTORE_STATE_LUA)
+
+        self.local = LocalTTLCache(settings.L1_CACHE_SIZE, settings.L1_CACHE_TTL)
+        self._listener = None
+
+    async def connect(self):
+        try:
+            await self.redis.ping()
+            logger.info(f"✅ Async Redis ulandi: {settings.REDIS_HOST}:{settings.REDIS_PORT}")
+        except Exception as e:
+            logger.error(f"❌ Async Redisga ulanishda xatolik: {e}")
+            self.redis = None
+            return
+        self._listener = asyncio.create_task(self._listen_invalidations())
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+        if self.redis:
+            await self.redis.close()
+
+    async def _listen_invalidations(self):
+        """Bot (yoki boshqa jarayon) e'lon qilgan kalitlarni L1 keshdan o'chiradi."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Uzilish paytida xabarlar o'tkazib yuborilgan bo'lishi mumkin
+                self.local.clear()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message:
+                        self.local.delete(message['data'])
+            except asyncio.CancelledError:
+                await pubsub.close()
+                raise
+            except Exception as e:
+                logger.error(f"Redis pub/sub xatosi: {e}")
+                await pubsub.close()
+                await asyncio.sleep(5)
+
+    async def _set_json(self, key: str, value: dict):
+        self.local.set(key, value)
+        if not self.redis: return
+        try:
+            await self.redis.set(key, json.dumps(value), ex=self.TTL)
+        except Exception as e:
+            logger.error(f"Redis set error ({key}): {e}")
+
+    async def set_device_info(self, device: Device, branch: Branch):
+        await self._set_json(f"device:{device.ip_address}", device_payload(device, branch))
+
+    async def set_employee_info(self, employee: Employee):
+        await self._set_json(f"emp:{employee.account_id}", employee_payload(employee))
+
+    async def restore_action_state(self, emp_id: str, ip: str, serial_no: Optional[int],
+                                   event_ms: int, resolution: EventResolution):
+        """
+        Hodisa navbatga yozilmay qolsa, skript o'zgartirgan holat va oynani oldingi qiymatiga qaytaradi
+        va serialNo ni bo'shatadi — qurilma qayta yuborganda u dublikat deb tashlanmaydi.
+        Oraliqda boshqa hodisa yozgan qiymatlarga tegilmaydi.
+        """
+        if not self.redis: return
+        try:
+            await self._restore_script(
+                keys=[f"state:{emp_id}", f"pass:{emp_id}"],
+                args=[
+                    state_value(resolution.action, event_ms), resolution.previous_state, STATE_TTL * 1000,
+                    event_ms, resolution.previous_pass, int(settings.DEDUP_WINDOW_SECONDS * 1000),
+                ]
+            )
+            if ip and serial_no is not None:
+                await self.redis.zrem(f"seen:{ip}", serial_no)
+        except Exception as e:
+            logger.error(f"Redis state restore error: {e}")
+
+    def _dedup_args(self, serial_no, event_ms):
+        return [
+            "" if serial_no is None else serial_no,
+            int(event_ms if event_ms is not None else time.time() * 1000),
+            int(settings.DEDUP_WINDOW_SECONDS * 1000),
+            # Backfill yoqilganda kursorgacha bo'lgan serialNo lar backfill tomonidan qisqartiriladi
+            settings.BACKFILL_SEEN_SERIALS_MAX if settings.BACKFILL_ENABLED else settings.DEDUP_SERIALS_PER_DEVICE,
+        ]
+
+    async def check_event(self, ip: str, emp_id: str, action: str,
+                          serial_no: int = None, event_ms: int = None) -> EventResolution:
+        """
+        Takroriy hodisani aniqlaydi (serialNo va vaqt oynasi), so'ng holatni atomar yangilaydi.
+        Kodi RESOLVE_OK, RESOLVE_REPEATED yoki RESOLVE_DUPLICATE bo'lgan natija qaytaradi.
+        """
+        if not self.redis: return EventResolution(RESOLVE_OK, action=action)
+        try:
+            code, previous_state, previous_pass = await self._event_script(
+                keys=[f"state:{emp_id}", f"seen:{ip}", f"pass:{emp_id}"],
+                args=[action, STATE_TTL] + self._dedup_args(serial_no, event_ms)
+            )
+        except Exception as e:
+            logger.error(f"Redis event check error: {e}")
+            return EventResolution(RESOLVE_OK, action=action)
+        return EventResolution(code, action=action, previous_state=previous_state, previous_pass=previous_pass)
+
+    async def resolve_event(self, ip: str, emp_id: str, fallback_action: str,
+                            serial_no: int = None, event_ms: int = None) -> EventResolution:
+        """
+        Qurilma, xodim ma'lumotini o'qiydi, takrorlarni ajratadi va holatni atomar yangilaydi — bitta Redis so'rovida.
+        Qurilma keshda bo'lmasa RESOLVE_DEVICE_MISS qaytadi va hech narsaga tegilmaydi.
+        Xodim keshda bo'lmasa employee=None bo'ladi (holat baribir yangilangan).
+        """
+        device = self.local.get(f"device:{ip}")
+        employee = self.local.get(f"emp:{emp_id}")
+        cache_lookup("l1", device is not None and employee is not None)
+        if device is not None and employee is not None:
+            # L1 dan topildi: faqat takror/holat tekshiruvi tarmoqqa chiqadi
+            action = _action_for(device, fallback_action)
+            checked = await self.check_event(ip, emp_id, action, serial_no, event_ms)
+            return checked._replace(device=device, employee=employee)
+
+        if not self.redis: return EventResolution(RESOLVE_UNAVAILABLE)
+        try:
+            code, device, employee, action, previous_state, previous_pass = await self._resolve_script(
+                keys=[f"device:{ip}", f"emp:{emp_id}", f"state:{emp_id}", f"seen:{ip}", f"pass:{emp_id}"],
+                args=[fallback_action, STATE_TTL] + self._dedup_args(serial_no, event_ms)
+            )
+        except Exception as e:
+            logger.error(f"Redis resolve_event error: {e}")
+            return EventResolution(RESOLVE_UNAVAILABLE)
+
+        cache_lookup("redis", code != RESOLVE_DEVICE_MISS and bool(employee))
+        if code == RESOLVE_DEVICE_MISS:
+            return EventResolution(code)
+
+        device = json.loads(device)
+        employee = json.loads(employee) if employee else None
+        self.local.set(f"device:{ip}", device)
+        if employee is not None:
+            self.local.set(f"emp:{emp_id}", employee)
+        return EventResolution(code, device, employee, action, previous_state, previous_pass)
 
-cache = CacheManager()
\ No newline at end of file
+cache = CacheManager()
+async_cache = AsyncCacheManager()
\ No newline at end of file
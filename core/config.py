@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Set
 
 SHEET_COLUMNS = {
     "branch_name": 1,     
@@ -29,6 +29,61 @@ class Settings(BaseSettings):
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
 
+    CACHE_TTL: int = 3600
+    CACHE_WARMUP_INTERVAL: int = 1800
+
+    L1_CACHE_SIZE: int = 20000
+    L1_CACHE_TTL: float = 300.0
+
+    SHEETS_BATCH_SIZE: int = 50
+    SHEETS_FLUSH_INTERVAL: float = 2.0
+
+    TELEGRAM_GLOBAL_RATE: float = 25.0
+    TELEGRAM_CHAT_RATE: float = 1.0
+
+    # Qurilmalar bilan bir vaqtda ishlaydigan oqimlar soni (har bir qurilmada bittadan)
+    DEVICE_MAX_WORKERS: int = 8
+
+    # Hikvision yuz kutubxonasi cheklovlari (rasm 200 KB gacha)
+    FACE_MAX_SIDE: int = 640
+    FACE_MAX_BYTES: int = 180 * 1024
+    FACE_STORE_DIR: str = "data/faces"
+
+    # "📋 Ma'lumotlar" statistikasi keshining muddati, soniya
+    STATS_CACHE_TTL: float = 60.0
+
+    # Xodimlar sheetini fon rejimida sinxronlash oralig'i, soniya (0 — o'chirilgan)
+    DIRECTORY_SYNC_INTERVAL: int = 900
+
+    # Qurilmada qo'lda yaratilgan, sinxronizatsiyada o'chirilmasligi kerak bo'lgan IDlar
+    RECONCILE_KEEP_IDS: str = ""
+
+    OUTBOX_LEASE_SECONDS: int = 120
+    OUTBOX_RETRY_BASE: float = 5.0
+    OUTBOX_RETRY_MAX: float = 900.0
+    OUTBOX_MAX_ATTEMPTS: int = 100
+    OUTBOX_DRAIN_TIMEOUT: float = 30.0
+
+    # Push o'rniga qurilmalardan alertStream orqali hodisalarni tortib olish
+    ALERT_STREAM_ENABLED: bool = False
+    ALERT_STREAM_SCHEME: str = "http"
+    ALERT_STREAM_READ_TIMEOUT: float = 90.0
+    ALERT_STREAM_MAX_BACKOFF: float = 60.0
+    ALERT_STREAM_REFRESH_INTERVAL: float = 300.0
+
+    # Server ishlamay qolgan paytdagi hodisalarni qurilma tarixidan tiklash (ixtiyoriy).
+    # Yoqilganda seen:{ip} kursordan keyingi barcha serialNo larni saqlaydi (BACKFILL_SEEN_SERIALS_MAX gacha)
+    BACKFILL_ENABLED: bool = False
+    BACKFILL_INTERVAL: float = 600.0
+    BACKFILL_OVERLAP_SECONDS: int = 60
+    BACKFILL_MAX_LOOKBACK_HOURS: int = 72
+    BACKFILL_SEEN_SERIALS_MAX: int = 100000
+
+    # Takroriy hodisalar: qurilma bo'yicha eslab qolinadigan serialNo soni va
+    # bir xodimning filialdagi ketma-ket o'tishlari orasidagi minimal vaqt (0 — o'chirilgan)
+    DEDUP_SERIALS_PER_DEVICE: int = 512
+    DEDUP_WINDOW_SECONDS: float = 10.0
+
     @property
     def google_worksheet_name_list(self) -> List[str]:
         """Agar nomlar yozilgan bo'lsa ro'yxat qiladi, bo'lmasa bo'sh ro'yxat qaytaradi"""
@@ -36,10 +91,18 @@ class Settings(BaseSettings):
             return []
         return [name.strip() for name in self.GOOGLE_WORKSHEET_NAMES.split(',') if name.strip()]
 
+    @property
+    def reconcile_keep_id_set(self) -> Set[str]:
+        return {i.strip() for i in self.RECONCILE_KEEP_IDS.split(',') if i.strip()}
+
     @property
     def DATABASE_URL(self):
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def ASYNC_DATABASE_URL(self):
+        return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
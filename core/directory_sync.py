@@ -0,0 +1,240 @@
+import hashlib
+import logging
+import threading
+from typing import Dict, List
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import cache
+from .database import SessionLocal
+from .models import Branch, Employee, DirectoryRowFingerprint, ACCOUNT_ID_SEQ
+
+logger = logging.getLogger(__name__)
+
+# Qo'lda va rejali sinxronizatsiya bir vaqtda ishlamasligi uchun
+_sync_lock = threading.Lock()
+
+UPSERT_CHUNK = 1000
+
+
+def normalize_text(text):
+    if not text: return ""
+    return text.lower().replace(" ", "")
+
+
+def allocate_account_ids(db, count: int, taken: set) -> List[str]:
+    """
+    Ketma-ketlikdan bitta so'rovda count ta yangi ID oladi.
+    Eski (tasodifiy yaratilgan) IDlar bilan to'qnashganlari tashlab yuboriladi.
+    """
+    ids = []
+    while len(ids) < count:
+        need = count - len(ids)
+        values = db.execute(select(ACCOUNT_ID_SEQ.next_value()).select_from(func.generate_series(1, need))).scalars()
+        ids.extend(str(v) for v in values if str(v) not in taken)
+    return ids
+
+
+def _upsert_employees(db, records: Dict[str, dict]):
+    """
+    INSERT ... ON CONFLICT (account_id) DO UPDATE — faqat ism yoki filial o'zgargan qatorlar yoziladi.
+    Yozilgan qatorlar (keshni yangilash uchun) qaytariladi.
+    """
+    table = Employee.__table__
+    changed = []
+    values = list(records.values())
+    for start in range(0, len(values), UPSERT_CHUNK):
+        stmt = insert(table).values(values[start:start + UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.account_id],
+            set_={"full_name": stmt.excluded.full_name, "branch_id": stmt.excluded.branch_id},
+            where=(table.c.full_name != stmt.excluded.full_name)
+                  | table.c.branch_id.is_distinct_from(stmt.excluded.branch_id),
+        ).returning(table.c.account_id, table.c.full_name, table.c.notification_chat_id)
+        changed.extend(db.execute(stmt).all())
+    return changed
+
+
+def sync_directory(db, raw_data) -> dict:
+    """
+    Sheetdagi xodimlar ro'yxatini bazaga bir o'tishda qo'llaydi.
+    raw_data: GoogleSheetManager.get_all_employees_raw() natijasi — (varaq nomi, row_num, data).
+    Filiallar va xodimlar bittadan so'rov bilan olinadi, yangi IDlar ketma-ketlikdan,
+    o'zgarishlar esa ommaviy upsert bilan yoziladi.
+    """
+    branches = dict(db.execute(select(Branch.name, Branch.id)).all())
+    employees = db.execute(select(Employee.account_id, Employee.full_name, Employee.branch_id)).all()
+
+    by_id = {e.account_id: {"account_id": e.account_id, "full_name": e.full_name, "branch_id": e.branch_id} for e in employees}
+    by_name = {(e.branch_id, normalize_text(e.full_name)): e.account_id for e in employees}
+    existing_ids = set(by_id)
+
+    report = {
+        "new": 0, "updated": 0, "generated": 0, "recovered": 0,
+        "not_found_branches": set(), "sheet_updates": {}, "changed_ids": set(),
+    }
+    records = {}
+    # Yangi ID kerak bo'lgan xodimlar: (branch_id, nom) -> yozuv; ID keyin ommaviy beriladi
+    pending = {}
+    pending_rows = []
+
+    for worksheet, row_num, data in raw_data:
+        sheet_acc_id = data['account_id']
+        full_name = data['full_name']
+        branch_id = branches.get(data['branch_name'])
+        if branch_id is None:
+            report["not_found_branches"].add(data['branch_name'])
+            continue
+
+        updates = report["sheet_updates"].setdefault(worksheet, [])
+
+        if sheet_acc_id:
+            current = by_id.get(sheet_acc_id)
+            if current is None:
+                report["new"] += 1
+            elif current["full_name"] != full_name or current["branch_id"] != branch_id:
+                report["updated"] += 1
+            else:
+                continue
+            record = {"account_id": sheet_acc_id, "full_name": full_name, "branch_id": branch_id}
+            by_id[sheet_acc_id] = records[sheet_acc_id] = record
+            continue
+
+        key = (branch_id, normalize_text(full_name))
+        if key in by_name:
+            account_id = by_name[key]
+            updates.append((row_num, account_id))
+            report["recovered"] += 1
+
+            current = by_id[account_id]
+            if current["full_name"] != full_name:
+                record = dict(current, full_name=full_name)
+                by_id[account_id] = records[account_id] = record
+                report["updated"] += 1
+        elif key in pending:
+            pending_rows.append((updates, row_num, pending[key]))
+            report["recovered"] += 1
+        else:
+            record = {"account_id": None, "full_name": full_name, "branch_id": branch_id}
+            pending[key] = record
+            pending_rows.append((updates, row_num, record))
+            report["generated"] += 1
+            report["new"] += 1
+
+    if pending:
+        new_ids = allocate_account_ids(db, len(pending), existing_ids | set(records))
+        for record, account_id in zip(pending.values(), new_ids):
+            record["account_id"] = account_id
+            records[account_id] = record
+        for updates, row_num, record in pending_rows:
+            updates.append((row_num, record["account_id"]))
+
+    changed = _upsert_employees(db, records) if records else []
+    db.commit()
+
+    report["changed"] = changed
+    report["changed_ids"] = {row.account_id for row in changed}
+    report["sheet_updates"] = {ws: updates for ws, updates in report["sheet_updates"].items() if updates}
+    logger.info(
+        f"📒 Katalog sinxronlandi: +{report['new']}, ~{report['updated']}, "
+        f"🆔 {report['generated']}, ♻️ {report['recovered']}"
+    )
+    return report
+
+
+def row_fingerprint(data: dict) -> str:
+    raw = "\x1f".join(data.get(field, "") for field in ("account_id", "full_name", "branch_name", "phone"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _load_fingerprints(db) -> Dict[tuple, str]:
+    rows = db.execute(select(
+        DirectoryRowFingerprint.worksheet, DirectoryRowFingerprint.row_num, DirectoryRowFingerprint.fingerprint
+    ))
+    return {(ws, row_num): fp for ws, row_num, fp in rows}
+
+
+def _save_fingerprints(db, upserts: Dict[tuple, tuple], removed):
+    """Faqat o'zgargan qatorlar izlari yoziladi, o'chirilganlari o'chiriladi."""
+    table = DirectoryRowFingerprint.__table__
+    values = [
+        {"worksheet": ws, "row_num": row_num, "fingerprint": fp, "account_id": account_id}
+        for (ws, row_num), (fp, account_id) in upserts.items()
+    ]
+    for start in range(0, len(values), UPSERT_CHUNK):
+        stmt = insert(table).values(values[start:start + UPSERT_CHUNK])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.worksheet, table.c.row_num],
+            set_={"fingerprint": stmt.excluded.fingerprint, "account_id": stmt.excluded.account_id,
+                  "updated_at": func.now()},
+        ))
+    removed = list(removed)
+    for start in range(0, len(removed), UPSERT_CHUNK):
+        db.execute(table.delete().where(
+            tuple_(table.c.worksheet, table.c.row_num).in_(removed[start:start + UPSERT_CHUNK])
+        ))
+    db.commit()
+
+
+def run_directory_sync(manager, incremental: bool = True) -> dict:
+    """
+    Sheetni o'qiydi va bazaga qo'llaydi. incremental=True bo'lsa oxirgi ishga tushirishdan beri
+    qo'shilgan yoki o'zgargan qatorlargina qayta ishlanadi (qator izi — sha256).
+    Yangi IDlar sheetga yoziladi, o'zgargan xodimlar keshga uzatiladi.
+    O'chirilgan qatorlar faqat izidan o'chiriladi: xodim bazada o'zgarishsiz qoladi (to'liq
+    sinxronizatsiyadagi kabi o'chirish bazaga uzatilmaydi), report["removed"] — ularning soni.
+    Sinxronizatsiya allaqachon ketayotgan bo'lsa None qaytadi.
+    """
+    if not _sync_lock.acquire(blocking=False):
+        return None
+    db = SessionLocal()
+    try:
+        raw_data = manager.get_all_employees_raw()
+        if not raw_data:
+            return {"empty": True}
+
+        previous = _load_fingerprints(db)
+        current = {(ws, row_num): row_fingerprint(data) for ws, row_num, data in raw_data}
+        # Qator o'chirilsa (yoki pastdagilari surilsa) faqat izi o'chiriladi, xodimga tegilmaydi
+        removed = set(previous) - set(current)
+
+        if incremental:
+            raw_data = [
+                (ws, row_num, data) for ws, row_num, data in raw_data
+                if previous.get((ws, row_num)) != current[(ws, row_num)]
+            ]
+
+        report = sync_directory(db, raw_data) if raw_data else {
+            "new": 0, "updated": 0, "generated": 0, "recovered": 0,
+            "not_found_branches": set(), "sheet_updates": {}, "changed": [], "changed_ids": set(),
+        }
+        cache.set_employees(report["changed"])
+
+        # Sheetga yozilgan ID qatorning yangi holati hisoblanadi, aks holda keyingi safar qayta o'qiladi
+        written = {}
+        for ws, updates in report["sheet_updates"].items():
+            if manager.batch_update_ids(ws, updates):
+                written.update({(ws, row_num): account_id for row_num, account_id in updates})
+
+        fingerprints = {}
+        for ws, row_num, data in raw_data:
+            key = (ws, row_num)
+            # Filiali topilmagan qatorlar filial yaratilgach qayta ko'riladi
+            if data['branch_name'] in report["not_found_branches"]: continue
+            if not data['account_id'] and key not in written: continue
+            account_id = data['account_id'] or written[key]
+            fp = row_fingerprint(dict(data, account_id=account_id))
+            if previous.get(key) != fp:
+                fingerprints[key] = (fp, account_id)
+
+        _save_fingerprints(db, fingerprints, removed)
+
+        report.update(rows=len(raw_data), removed=len(removed))
+        return report
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+        _sync_lock.release()
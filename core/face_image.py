@@ -0,0 +1,42 @@
+from io import BytesIO
+from PIL import Image, ImageOps
+from .config import settings
+
+
+def pick_photo_size(photo_sizes, max_side: int = None):
+    """
+    Telegram PhotoSize lardan qurilmaga yetarli bo'lgan eng kichigini tanlaydi
+    (max_side dan kichik bo'lmagan). Bunday o'lcham bo'lmasa eng kattasi olinadi.
+    """
+    max_side = max_side or settings.FACE_MAX_SIDE
+    big_enough = [p for p in photo_sizes if max(p.width, p.height) >= max_side]
+    if big_enough:
+        return min(big_enough, key=lambda p: p.width * p.height)
+    return max(photo_sizes, key=lambda p: p.width * p.height)
+
+
+def prepare_face_image(image_bytes: bytes, max_side: int = None, max_bytes: int = None) -> bytes:
+    """
+    Rasmni qurilma cheklovlariga moslaydi: EXIF bo'yicha buradi, max_side gacha kichraytiradi,
+    max_bytes dan oshmaguncha JPEG sifatini pasaytiradi. Natijada EXIF saqlanmaydi.
+    """
+    max_side = max_side or settings.FACE_MAX_SIDE
+    max_bytes = max_bytes or settings.FACE_MAX_BYTES
+
+    img = Image.open(BytesIO(image_bytes))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    quality = 90
+    while True:
+        out = BytesIO()
+        img.save(out, "JPEG", quality=quality, optimize=True)
+        if out.tell() <= max_bytes:
+            return out.getvalue()
+
+        if quality > 50:
+            quality -= 10
+        elif min(img.size) > 200:
+            img = img.resize((int(img.width * 0.8), int(img.height * 0.8)), Image.LANCZOS)
+        else:
+            return out.getvalue()
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+from typing import Dict, Optional
+from sqlalchemy import bindparam
+from .config import settings
+from .models import Employee
+
+
+class FaceStore:
+    """
+    Yuz rasmlari uchun kontent-manzilli ombor: fayl nomi — rasmning sha256 xeshi.
+    Bir xil rasm bir marta saqlanadi; xesh Employee.photo_hash ga yoziladi.
+    """
+    def __init__(self, root: str = None):
+        self.root = root or settings.FACE_STORE_DIR
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.jpg")
+
+    def put(self, image_bytes: bytes) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return digest
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def get(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self.path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+def link_photos(db, photos: Dict[str, str]):
+    """{account_id: xesh} bo'yicha Employee.photo_hash va photo_status ni bitta executemany bilan yozadi."""
+    if not photos: return
+    table = Employee.__table__
+    stmt = (
+        table.update()
+        .where(table.c.account_id == bindparam("acc_id"))
+        .values(photo_hash=bindparam("digest"), photo_status=True)
+    )
+    db.execute(stmt, [{"acc_id": acc_id, "digest": digest} for acc_id, digest in photos.items()])
+    db.commit()
+
+
+face_store = FaceStore()
@@ -1,22 +1,75 @@
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPDigestAuth
 import json
 import logging
-from typing import List, Tuple
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import uuid
+from typing import Dict, Iterator, List, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import urllib3  
+from .config import settings
+from .metrics import DEVICE_ERRORS, stage_timer
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _get_session(ip, username, password) -> requests.Session:
+    """
+    Har bir qurilma (IP + login) uchun bitta doimiy sessiya: TLS ulanish qayta ishlatiladi,
+    HTTPDigestAuth esa oxirgi nonce ni eslab qoladi va keyingi so'rovlarda 401 bosqichisiz yuboradi.
+    """
+    key = (ip, username, password)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.auth = HTTPDigestAuth(username, password)
+            session.verify = False
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            _sessions[key] = session
+    return session
+
+USER_VALID_FROM = "2020-01-01T00:00:00"
+USER_VALID_TO = "2035-01-01T00:00:00"
+
+def _user_info(user_id: str) -> dict:
+    return {
+        "employeeNo": user_id,
+        "userType": "normal",
+        "doorRight": "1",
+        "RightPlan": [{"doorNo": 1, "planTemplateNo": "1"}],
+        "Valid": {"enable": True, "beginTime": USER_VALID_FROM, "endTime": USER_VALID_TO}
+    }
+
+def _is_ok(resp) -> bool:
+    if resp.status_code not in (200, 201):
+        return False
+    try:
+        return resp.json().get('statusCode', 1) == 1
+    except ValueError:
+        return True
+
+def _error_text(resp) -> str:
+    try:
+        return resp.json().get('statusString') or resp.text[:200]
+    except ValueError:
+        return f"HTTP {resp.status_code}: {resp.text[:200]}"
+
 class HikDeviceClient:
     def __init__(self, ip, username, password):
+        self.ip = ip
         self.base_url = f"https://{ip}"  
-        self.auth = HTTPDigestAuth(username, password)
+        self.session = _get_session(ip, username, password)
         self.timeout = 10 
 
-    def set_access_group(self, user_id: str):
+    def ensure_access_group(self):
         group_url = f"{self.base_url}/ISAPI/AccessControl/AccessGroup/Record?format=json"
         group_payload = {
             "AccessGroup": {
@@ -30,63 +83,135 @@ class HikDeviceClient:
             }
         }
         try:
-            requests.post(group_url, data=json.dumps(group_payload), auth=self.auth, timeout=self.timeout, verify=False)
+            self.session.post(group_url, data=json.dumps(group_payload), timeout=self.timeout)
         except:
             pass
 
+    def add_access_group_members(self, user_ids: List[str]) -> bool:
         member_url = f"{self.base_url}/ISAPI/AccessControl/AccessGroup/Member/Record?format=json"
         member_payload = {
             "AccessGroupMemberList": [
                 {
                     "accessGroupID": 1,
-                    "UserList": [
-                        {"employeeNo": user_id}
-                    ]
+                    "UserList": [{"employeeNo": user_id} for user_id in user_ids]
                 }
             ]
         }
         
         try:
-            resp = requests.post(member_url, data=json.dumps(member_payload), auth=self.auth, timeout=self.timeout, verify=False)
+            resp = self.session.post(member_url, data=json.dumps(member_payload), timeout=self.timeout)
             if resp.status_code == 200 or resp.status_code == 201:
                 return True
             return False
         except:
             return False
 
-    def upload_face(self, user_id: str, image_bytes: bytes) -> Tuple[bool, str]:
-        start_time = "2020-01-01T00:00:00"
-        end_time = "2035-01-01T00:00:00"
+    def set_access_group(self, user_id: str):
+        self.ensure_access_group()
+        return self.add_access_group_members([user_id])
+
+    def delete_users(self, user_ids: List[str], timeout: float = 3) -> bool:
+        del_url = f"{self.base_url}/ISAPI/AccessControl/UserInfo/Delete?format=json"
+        del_payload = {"UserInfoDetail": {"mode": "byEmployeeNo", "EmployeeNoList": [{"employeeNo": u} for u in user_ids]}}
+        try:
+            resp = self.session.put(del_url, data=json.dumps(del_payload), timeout=timeout)
+            return _is_ok(resp)
+        except:
+            return False
 
+    def _put_user(self, user_id: str):
         user_url = f"{self.base_url}/ISAPI/AccessControl/UserInfo/Record?format=json"
-        
-        user_payload = {
-            "UserInfo": {
-                "employeeNo": user_id,
-                "userType": "normal",
-                "doorRight": "1",
-                "RightPlan": [{"doorNo": 1, "planTemplateNo": "1"}],
-                "Valid": {"enable": True, "beginTime": start_time, "endTime": end_time}
-            }
-        }
+        user_payload = {"UserInfo": _user_info(user_id)}
+        resp = self.session.post(user_url, data=json.dumps(user_payload), timeout=self.timeout)
+        if resp.status_code != 200:
+            modify_url = f"{self.base_url}/ISAPI/AccessControl/UserInfo/Modify?format=json"
+            resp = self.session.put(modify_url, data=json.dumps(user_payload), timeout=self.timeout)
+        return resp
 
+    def add_users(self, user_ids: List[str]) -> Dict[str, str]:
+        """
+        Foydalanuvchilarni bitta UserInfo/Record so'rovida (ro'yxat ko'rinishida) qo'shadi.
+        Proshivka ro'yxatni qabul qilmasa, har biri alohida yoziladi.
+        Xato bo'lganlar {user_id: xabar} ko'rinishida qaytariladi.
+        """
+        if not user_ids: return {}
+        user_url = f"{self.base_url}/ISAPI/AccessControl/UserInfo/Record?format=json"
+        payload = {"UserInfo": [_user_info(u) for u in user_ids]}
         try:
+            resp = self.session.post(user_url, data=json.dumps(payload), timeout=self.timeout)
+            if _is_ok(resp):
+                return {}
+        except Exception as e:
+            logger.warning(f"Ko'p foydalanuvchili yozuv ishlamadi ({self.base_url}): {e}")
+
+        failed = {}
+        for user_id in user_ids:
             try:
-                del_url = f"{self.base_url}/ISAPI/AccessControl/UserInfo/Delete?format=json"
-                del_payload = {"UserInfoDetail": {"mode": "byEmployeeNo", "EmployeeNoList": [{"employeeNo": user_id}]}}
-                requests.put(del_url, data=json.dumps(del_payload), auth=self.auth, timeout=3, verify=False)
-            except:
-                pass
+                resp = self._put_user(user_id)
+            except Exception as e:
+                failed[user_id] = f"Ulanish xatosi (User): {str(e)}"
+                continue
+            if not _is_ok(resp):
+                failed[user_id] = f"Foydalanuvchi xatosi: {_error_text(resp)}"
+        return failed
 
-            resp = requests.post(user_url, data=json.dumps(user_payload), auth=self.auth, timeout=self.timeout, verify=False)
-            
-            if resp.status_code != 200:
-                 modify_url = f"{self.base_url}/ISAPI/AccessControl/UserInfo/Modify?format=json"
-                 requests.put(modify_url, data=json.dumps(user_payload), auth=self.auth, timeout=self.timeout, verify=False)
+    def list_user_ids(self, page_size: int = 30) -> List[str]:
+        """Qurilmadagi barcha foydalanuvchilarni UserInfo/Search orqali sahifalab o'qiydi."""
+        search_url = f"{self.base_url}/ISAPI/AccessControl/UserInfo/Search?format=json"
+        search_id = uuid.uuid4().hex
+        position = 0
+        user_ids = []
+        while True:
+            payload = {
+                "UserInfoSearchCond": {
+                    "searchID": search_id,
+                    "searchResultPosition": position,
+                    "maxResults": page_size
+                }
+            }
+            resp = self.session.post(search_url, data=json.dumps(payload), timeout=self.timeout)
+            resp.raise_for_status()
+            result = resp.json().get("UserInfoSearch", {})
 
-        except Exception as e:
-            return False, f"Ulanish xatosi (User): {str(e)}"
+            users = result.get("UserInfo") or []
+            user_ids.extend(str(u["employeeNo"]) for u in users if u.get("employeeNo"))
+            position += int(result.get("numOfMatches", len(users)))
+
+            if result.get("responseStatusStrg") != "MORE" or not users:
+                return user_ids
+
+    def search_events(self, start_time: str, end_time: str, page_size: int = 30) -> Iterator[dict]:
+        """
+        AcsEvent tarixidan [start_time, end_time] oralig'idagi kirish hodisalarini sahifalab qaytaradi.
+        Vaqtlar qurilma formatida: "2024-01-01T09:00:00+05:00".
+        """
+        search_url = f"{self.base_url}/ISAPI/AccessControl/AcsEvent?format=json"
+        search_id = uuid.uuid4().hex
+        position = 0
+        while True:
+            payload = {
+                "AcsEventCond": {
+                    "searchID": search_id,
+                    "searchResultPosition": position,
+                    "maxResults": page_size,
+                    "major": 5,
+                    "minor": 0,
+                    "startTime": start_time,
+                    "endTime": end_time
+                }
+            }
+            resp = self.session.post(search_url, data=json.dumps(payload), timeout=self.timeout)
+            resp.raise_for_status()
+            result = resp.json().get("AcsEvent", {})
+
+            events = result.get("InfoList") or []
+            yield from events
+            position += int(result.get("numOfMatches", len(events)))
+
+            if result.get("responseStatusStrg") != "MORE" or not events:
+                return
 
+    def upload_face_image(self, user_id: str, image_bytes: bytes) -> Tuple[bool, str]:
         face_url = f"{self.base_url}/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json"
         face_data = {
             "faceLibType": "blackFD",
@@ -99,9 +224,7 @@ class HikDeviceClient:
                 'FaceDataRecord': (None, json.dumps(face_data), 'application/json'),
                 'img': ('face.jpg', image_bytes, 'image/jpeg')
             }
-            resp = requests.post(face_url, files=files, auth=self.auth, timeout=15, verify=False)
-            
-            self.set_access_group(user_id)
+            resp = self.session.post(face_url, files=files, timeout=15)
 
             try:
                 data = resp.json()
@@ -114,6 +237,56 @@ class HikDeviceClient:
         except Exception as e:
             return False, f"Ulanish xatosi (Face): {str(e)}"
 
+    def upload_face(self, user_id: str, image_bytes: bytes) -> Tuple[bool, str]:
+        with stage_timer("device_upload"):
+            success, msg = self._upload_face(user_id, image_bytes)
+        if not success:
+            DEVICE_ERRORS.labels(self.ip, "upload").inc()
+        return success, msg
+
+    def _upload_face(self, user_id: str, image_bytes: bytes) -> Tuple[bool, str]:
+        try:
+            self.delete_users([user_id])
+            resp = self._put_user(user_id)
+        except Exception as e:
+            return False, f"Ulanish xatosi (User): {str(e)}"
+        if not _is_ok(resp):
+            return False, f"Foydalanuvchi xatosi: {_error_text(resp)}"
+
+        success, msg = self.upload_face_image(user_id, image_bytes)
+        self.set_access_group(user_id)
+        return success, msg
+
+    def enroll_many(self, users: List[Tuple[str, bytes]]) -> Dict[str, Tuple[bool, str]]:
+        """
+        Bir nechta xodimni bitta partiyada yozadi: bitta delete, bitta (ko'p foydalanuvchili) UserInfo,
+        har bir yuz uchun FaceDataRecord va bitta AccessGroup a'zolik so'rovi.
+        """
+        with stage_timer("device_upload"):
+            results = self._enroll_many(users)
+        failed = sum(1 for success, _ in results.values() if not success)
+        if failed:
+            DEVICE_ERRORS.labels(self.ip, "upload").inc(failed)
+        return results
+
+    def _enroll_many(self, users: List[Tuple[str, bytes]]) -> Dict[str, Tuple[bool, str]]:
+        user_ids = [user_id for user_id, _ in users]
+        self.delete_users(user_ids, timeout=self.timeout)
+        failed = self.add_users(user_ids)
+
+        results = {user_id: (False, msg) for user_id, msg in failed.items()}
+        enrolled = []
+        for user_id, image_bytes in users:
+            if user_id in failed: continue
+            results[user_id] = self.upload_face_image(user_id, image_bytes)
+            if results[user_id][0]:
+                enrolled.append(user_id)
+
+        if enrolled:
+            self.ensure_access_group()
+            self.add_access_group_members(enrolled)
+        return results
+
 def _upload_single_device_task(dev_info: dict, user_id: str, image_bytes: bytes):
     ip = dev_info['ip']
     user = dev_info['user']
@@ -123,16 +296,81 @@ def _upload_single_device_task(dev_info: dict, user_id: str, image_bytes: bytes)
         success, msg = client.upload_face(user_id, image_bytes)
         return {"ip": ip, "success": success, "msg": msg}
     except Exception as e:
+        DEVICE_ERRORS.labels(ip, "upload").inc()
         return {"ip": ip, "success": False, "msg": f"System Error: {str(e)}"}
 
-def upload_to_branch_devices(devices: List[dict], user_id: str, image_bytes: bytes):
-    results = []
-    max_threads = 10
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
-        futures = [executor.submit(_upload_single_device_task, dev, user_id, image_bytes) for dev in devices]
-        for future in futures:
+class DeviceJobQueue:
+    """
+    Qurilmalar bilan ishlash uchun umumiy oqimlar hovuzi.
+    Har bir qurilmada bir vaqtda faqat bitta vazifa bajariladi (terminallar parallel so'rovlarni yomon ko'taradi),
+    umumiy parallellik esa hovuz hajmi bilan cheklanadi.
+    Oqimlar qayta ishlatilgani uchun digest nonce ham keyingi vazifalarda saqlanib qoladi.
+    priority=True vazifalar (xodimning selfisi) oddiy navbatdan oldin olinadi va uzoq vazifalar
+    partiyalari orasida ham bajariladi (run_priority).
+    """
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hik-device")
+        self._lock = threading.Lock()
+        # device_key -> (shoshilinch navbat, oddiy navbat)
+        self._queues = {}
+
+    def submit(self, device_key: str, fn, *args, priority: bool = False) -> Future:
+        future = Future()
+        with self._lock:
+            lanes = self._queues.get(device_key)
+            if lanes is None:
+                # Qurilma bo'sh: navbat ochiladi va darhol ishga tushiriladi
+                self._queues[device_key] = (deque(), deque())
+                self._executor.submit(self._run, device_key, fn, args, future)
+            else:
+                lanes[0 if priority else 1].append((fn, args, future))
+        return future
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(high) + len(normal) for high, normal in self._queues.values())
+
+    def run_priority(self, device_key: str):
+        """
+        Uzoq vazifa (ommaviy yuklash, solishtirish) partiyalar orasida chaqiradi: shu qurilmaga kelgan
+        shoshilinch vazifalar joriy oqimda darhol bajariladi. Faqat shu qurilmaning vazifasi ichidan
+        chaqirilishi kerak — qurilmada baribir bir vaqtda bitta so'rov bo'ladi.
+        """
+        while True:
+            with self._lock:
+                lanes = self._queues.get(device_key)
+                if not lanes or not lanes[0]: return
+                job = lanes[0].popleft()
+            self._execute(*job)
+
+    @staticmethod
+    def _execute(fn, args, future):
+        if future.set_running_or_notify_cancel():
             try:
-                results.append(future.result())
+                future.set_result(fn(*args))
             except Exception as e:
-                logger.error(f"Thread execution failed: {e}")
-    return results
+                future.set_exception(e)
+
+    def _run(self, device_key, fn, args, future):
+        self._execute(fn, args, future)
+
+        with self._lock:
+            high, normal = self._queues[device_key]
+            queue = high or normal
+            if not queue:
+                del self._queues[device_key]
+                return
+            # Keyingi vazifa hovuz oxiriga qo'yiladi, shunda boshqa qurilmalar ham navbat oladi
+            self._executor.submit(self._run, device_key, *queue.popleft())
+
+device_jobs = DeviceJobQueue(settings.DEVICE_MAX_WORKERS)
+
+def submit_branch_upload(devices: List[dict], user_id: str, image_bytes: bytes) -> List[Future]:
+    """
+    Har bir qurilma uchun yuklash vazifasini shoshilinch navbatga qo'yadi (xodim natijani kutib turibdi);
+    natija {"ip", "success", "msg"}.
+    """
+    return [
+        device_jobs.submit(dev['ip'], _upload_single_device_task, dev, user_id, image_bytes, priority=True)
+        for dev in devices
+    ]
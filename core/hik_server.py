@@ -1,15 +1,27 @@
-from fastapi import FastAPI, Request, Depends, BackgroundTasks
-from sqlalchemy.orm import Session
-import json
+from fastapi import FastAPI, Request, Depends
+from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import logging
-import requests
-from datetime import datetime, timedelta, timezone
+import time
+import orjson
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from datetime import datetime
 
-from .database import get_db
+from .database import get_async_db, AsyncSessionLocal
 from .models import Device, Employee, Branch, DeviceType
 from .sheets import GoogleSheetManager
+from .outbox import OutboxWorker, enqueue_async
+from .notifier import TelegramDispatcher
 from .config import settings
-from .cache import cache  
+from .cache import async_cache, device_payload, RESOLVE_OK, RESOLVE_DUPLICATE, RESOLVE_REPEATED
+from .multipart import MultipartStreamParser, boundary_from, is_event_part, parse_event_part
+from .alert_stream import AlertStreamConsumer
+from .metrics import EVENTS, QUEUE_DEPTH, stage_timer
+from .hik_device import device_jobs
+from .backfill import EventBackfiller
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,150 +29,235 @@ logger = logging.getLogger(__name__)
 app = FastAPI()
 sheet_manager = GoogleSheetManager()
 
-def send_telegram_alert(chat_id, message):
-    try:
-        url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage"
-        payload = {
-            "chat_id": chat_id,
-            "text": message,
-            "parse_mode": "Markdown"
-        }
-        requests.post(url, json=payload, timeout=5)
-    except Exception as e:
-        logger.error(f"Telegram alert error: {e}")
+telegram_dispatcher = TelegramDispatcher(settings.BOT_TOKEN)
+outbox_worker = OutboxWorker(sheet_manager, telegram_dispatcher)
+alert_stream = None
+event_backfiller = None
 
-def process_attendance_task(sheet_id: str, emp_name: str, emp_id: str, action: str, notif_chat_id: int, branch_name: str):
-    try:
-        sheet_manager.log_attendance(
-            sheet_id=sheet_id,
-            employee_name=emp_name,
-            employee_id=emp_id,
-            action=action
-        )
-
-        if notif_chat_id:
-            emoji = "✅" if action == "KIRISH" else "❌" if action == "CHIQISH" else "⚠️"
-            uz_tz = timezone(timedelta(hours=5))
-            current_time = datetime.now(uz_tz).strftime('%H:%M:%S')
-            
-            alert_text = (
-                f"{emoji} **DAVOMAT BILDIRISHNOMASI**\n\n"
-                f"👤 **Xodim:** {emp_name}\n"
-                f"🏢 **Filial:** {branch_name}\n"
-                f"🔄 **Holat:** {action}\n"
-                f"⏰ **Vaqt:** {current_time}"
+@app.on_event("startup")
+async def on_startup():
+    global alert_stream, event_backfiller
+    await async_cache.connect()
+    telegram_dispatcher.start()
+    outbox_worker.start()
+
+    loop = asyncio.get_running_loop()
+    if settings.BACKFILL_ENABLED:
+        event_backfiller = EventBackfiller(loop, process_pulled_event)
+        event_backfiller.start()
+
+    if settings.ALERT_STREAM_ENABLED:
+        # Qayta ulanganda uzilish paytidagi hodisalar tarixdan tiklanadi
+        on_connect = event_backfiller.trigger if event_backfiller else None
+        alert_stream = AlertStreamConsumer(loop, process_pulled_event, on_connect=on_connect)
+        alert_stream.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if alert_stream:
+        alert_stream.stop()
+    if event_backfiller:
+        event_backfiller.stop()
+    await run_in_threadpool(outbox_worker.stop)
+    await run_in_threadpool(telegram_dispatcher.stop)
+    await async_cache.close()
+
+def sub_event_action(sub_event_type) -> str:
+    """Universal qurilmalar uchun action hodisa turidan aniqlanadi."""
+    if sub_event_type in [21, 75]:
+        return "KIRISH"
+    if sub_event_type in [22, 104]:
+        return "CHIQISH"
+    return f"O'TISH ({sub_event_type})"
+
+def resolve_action(device_type_val: str, sub_event_type) -> str:
+    if device_type_val == "entry":
+        return "KIRISH"
+    if device_type_val == "exit":
+        return "CHIQISH"
+    return sub_event_action(sub_event_type)
+
+class OutboxUnavailable(Exception):
+    pass
+
+async def process_event(data: dict, db: AsyncSession, event_time: datetime = None) -> dict:
+    """
+    Hodisani qayta ishlaydi (HTTP push, alertStream va backfill uchun umumiy yo'l).
+    event_time faqat tarixdan tiklangan hodisalar uchun beriladi, aks holda qabul vaqti olinadi.
+    Navbatga yozib bo'lmasa OutboxUnavailable ko'tariladi.
+    """
+    event_type = data.get('eventType')
+    
+    if event_type == 'AccessControllerEvent':
+        details = data.get('AccessControllerEvent')
+        
+        device_ip = data.get('ipAddress')
+        employee_id = details.get('employeeNoString')
+        sub_event_type = details.get('subEventType')
+        serial_no = details.get('serialNo')
+        serial_no = int(serial_no) if str(serial_no).isdigit() else None
+        
+        if not device_ip or not employee_id:
+            EVENTS.labels("missing_fields").inc()
+            return {"status": "ignored", "msg": "Missing IP or ID"}
+
+        event_ms = int((event_time.timestamp() if event_time else time.time()) * 1000)
+        with stage_timer("cache_lookup"):
+            resolved = await async_cache.resolve_event(
+                device_ip, employee_id, sub_event_action(sub_event_type), serial_no, event_ms
             )
-            send_telegram_alert(notif_chat_id, alert_text)
+
+        if resolved.code == RESOLVE_REPEATED:
+            logger.info(f"⏭ SKIPPED (Repeated): {device_ip} #{serial_no} | {employee_id}")
+            EVENTS.labels("repeated").inc()
+            return {"status": "ignored", "msg": "Repeated event skipped"}
+
+        if resolved.code == RESOLVE_DUPLICATE:
+            emp_name = resolved.employee['full_name'].title() if resolved.employee else employee_id
+            logger.info(f"⏭ SKIPPED (Duplicate State): {emp_name} allaqachon {resolved.action} holatida.")
+            EVENTS.labels("duplicate_state").inc()
+            return {"status": "ignored", "msg": "Duplicate action skipped"}
+
+        if resolved.device:
+            device_info = resolved.device
+            action = resolved.action
+        else:
+            with stage_timer("db_fallback"):
+                result = await db.execute(
+                    select(Device, Branch)
+                    .outerjoin(Branch, Branch.id == Device.branch_id)
+                    .where(Device.ip_address == device_ip)
+                    .limit(1)
+                )
+            row = result.first()
+            if not row:
+                logger.warning(f"Noma'lum qurilmadan signal: {device_ip}")
+                EVENTS.labels("unknown_device").inc()
+                return {"status": "ignored", "msg": "Unknown Device"}
+
+            device, branch = row
+            if not branch:
+                EVENTS.labels("no_branch").inc()
+                return {"status": "error", "msg": "Branch not found"}
             
-    except Exception as e:
-        logger.error(f"Background task error: {e}")
+            await async_cache.set_device_info(device, branch)
+            device_info = device_payload(device, branch)
+            action = resolve_action(device_info['device_type'], sub_event_type)
+
+        branch_id = device_info['branch_id']
+        branch_name = device_info['branch_name']
+        sheet_id = device_info['sheet_id']
+
+        emp_info = resolved.employee
+        
+        if not emp_info:
+            with stage_timer("db_fallback"):
+                result = await db.execute(select(Employee).where(Employee.account_id == employee_id))
+            employee = result.scalars().first()
+            
+            if employee:
+                emp_name = employee.full_name.title()
+                notif_chat_id = employee.notification_chat_id
+                await async_cache.set_employee_info(employee)
+            else:
+                emp_name = "Noma'lum Xodim"
+                notif_chat_id = None
+        else:
+            emp_name = emp_info['full_name'].title()
+            notif_chat_id = emp_info['chat_id']
+
+        # Qurilma keshdan topilgan bo'lsa takror va holat skriptda allaqachon tekshirilgan
+        if resolved.code != RESOLVE_OK:
+            with stage_timer("cache_lookup"):
+                resolved = await async_cache.check_event(device_ip, employee_id, action, serial_no, event_ms)
+
+            if resolved.code == RESOLVE_REPEATED:
+                logger.info(f"⏭ SKIPPED (Repeated): {device_ip} #{serial_no} | {emp_name}")
+                EVENTS.labels("repeated").inc()
+                return {"status": "ignored", "msg": "Repeated event skipped"}
+            if resolved.code == RESOLVE_DUPLICATE:
+                logger.info(f"⏭ SKIPPED (Duplicate State): {emp_name} allaqachon {action} holatida.")
+                EVENTS.labels("duplicate_state").inc()
+                return {"status": "ignored", "msg": "Duplicate action skipped"}
+
+        if action in ["KIRISH", "CHIQISH"]:
+            logger.info(f"SIGNAL: {branch_name} | {emp_name} | {action}")
+            
+            try:
+                with stage_timer("outbox_enqueue"):
+                    await enqueue_async(
+                        db,
+                        sheet_id=sheet_id,
+                        branch_id=branch_id,
+                        branch_name=branch_name,
+                        device_ip=device_ip,
+                        employee_id=employee_id,
+                        employee_name=emp_name,
+                        action=action,
+                        notif_chat_id=notif_chat_id,
+                        event_time=event_time,
+                        device_serial=serial_no
+                    )
+            except Exception as e:
+                logger.error(f"Navbatga yozishda xato: {e}")
+                EVENTS.labels("outbox_error").inc()
+                await async_cache.restore_action_state(employee_id, device_ip, serial_no, event_ms, resolved)
+                raise OutboxUnavailable() from e
+            outbox_worker.notify()
+            EVENTS.labels("queued").inc()
+        else:
+            EVENTS.labels("passed").inc()
+
+    return {"status": "success", "msg": "Queued for delivery"}
+
+async def read_multipart_event(request: Request, content_type: str):
+    """
+    Hodisa JSON qismini so'rov tanasini oqim sifatida o'qib topadi.
+    Surat qismlari xotirada yig'ilmaydi, JSON topilgach qolgan qismlar o'qilmaydi.
+    """
+    boundary = boundary_from(content_type)
+    if not boundary:
+        return None
+    parser = MultipartStreamParser(boundary, keep=is_event_part)
+    async for chunk in request.stream():
+        for headers, body in parser.feed(chunk):
+            data = parse_event_part(headers, body)
+            if data:
+                return data
+    return None
+
+async def process_pulled_event(data: dict, event_time: datetime = None) -> dict:
+    """alertStream yoki backfill dan kelgan hodisa uchun o'z sessiyasini ochadi."""
+    async with AsyncSessionLocal() as db:
+        return await process_event(data, db, event_time=event_time)
+
+QUEUE_DEPTH.labels("telegram").set_function(telegram_dispatcher.pending)
+QUEUE_DEPTH.labels("device_jobs").set_function(device_jobs.pending)
+QUEUE_DEPTH.labels("outbox").set_function(lambda: outbox_worker.pending)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.post("/api/hikvision/event")
-async def receive_event(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def receive_event(request: Request, db: AsyncSession = Depends(get_async_db)):
     try:
         content_type = request.headers.get('content-type', '')
         data = None
 
         if "application/json" in content_type:
-            data = await request.json()
-        elif "multipart/form-data" in content_type:
-            form = await request.form()
-            for key, value in form.items():
-                if isinstance(value, str) and "eventType" in value:
-                    try:
-                        data = json.loads(value)
-                        break
-                    except:
-                        continue
+            data = orjson.loads(await request.body())
+        elif "multipart/" in content_type:
+            data = await read_multipart_event(request, content_type)
         
         if not data:
             return {"status": "failed", "msg": "No data found"}
 
-        event_type = data.get('eventType')
-        
-        if event_type == 'AccessControllerEvent':
-            details = data.get('AccessControllerEvent')
-            
-            device_ip = data.get('ipAddress')
-            employee_id = details.get('employeeNoString')
-            sub_event_type = details.get('subEventType')
-            
-            if not device_ip or not employee_id:
-                return {"status": "ignored", "msg": "Missing IP or ID"}
-
-            device_info = cache.get_device_info(device_ip)
-            
-            if not device_info:
-                device = db.query(Device).filter(Device.ip_address == device_ip).first()
-                if not device:
-                    logger.warning(f"Noma'lum qurilmadan signal: {device_ip}")
-                    return {"status": "ignored", "msg": "Unknown Device"}
-
-                branch = db.query(Branch).filter(Branch.id == device.branch_id).first()
-                if not branch:
-                    return {"status": "error", "msg": "Branch not found"}
-                
-                cache.set_device_info(device, branch)
-                
-                device_type_val = device.device_type.value
-                branch_name = branch.name
-                sheet_id = branch.attendance_sheet_id
-            else:
-                device_type_val = device_info['device_type']
-                branch_name = device_info['branch_name']
-                sheet_id = device_info['sheet_id']
-
-            emp_info = cache.get_employee_info(employee_id)
-            
-            if not emp_info:
-                employee = db.query(Employee).filter(Employee.account_id == employee_id).first()
-                
-                if employee:
-                    emp_name = employee.full_name.title()
-                    notif_chat_id = employee.notification_chat_id
-                    cache.set_employee_info(employee)
-                else:
-                    emp_name = "Noma'lum Xodim"
-                    notif_chat_id = None
-            else:
-                emp_name = emp_info['full_name'].title()
-                notif_chat_id = emp_info['chat_id']
-
-            action = "Noma'lum"
-            
-            if device_type_val == "entry":
-                action = "KIRISH"
-            elif device_type_val == "exit":
-                action = "CHIQISH"
-            else:
-                if sub_event_type in [21, 75]: 
-                    action = "KIRISH"
-                elif sub_event_type in [22, 104]: 
-                    action = "CHIQISH"
-                else: 
-                    action = f"O'TISH ({sub_event_type})"
-
-            if action in ["KIRISH", "CHIQISH"]:
-                should_log = cache.check_action_state(employee_id, action)
-                
-                if not should_log:
-                    logger.info(f"⏭ SKIPPED (Duplicate State): {emp_name} allaqachon {action} holatida.")
-                    return {"status": "ignored", "msg": "Duplicate action skipped"}
-
-                logger.info(f"SIGNAL: {branch_name} | {emp_name} | {action}")
-                
-                background_tasks.add_task(
-                    process_attendance_task,
-                    sheet_id,
-                    emp_name,
-                    employee_id,
-                    action,
-                    notif_chat_id,
-                    branch_name
-                )
-
-        return {"status": "success", "msg": "Processed in background"}
+        return await process_event(data, db)
 
+    except OutboxUnavailable:
+        # Qurilma hodisani qayta yuborishi uchun 2xx qaytarilmaydi
+        return JSONResponse(status_code=503, content={"status": "error", "msg": "Outbox unavailable"})
     except Exception as e:
         logger.error(f"Server xatosi: {e}")
         return {"status": "error", "msg": str(e)}
\ No newline at end of file
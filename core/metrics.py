@@ -0,0 +1,43 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Bot va FastAPI bitta jarayonda ishlaydi, shuning uchun standart registry yetarli (/metrics)
+
+STAGE_LATENCY = Histogram(
+    "hik_stage_seconds",
+    "Ingest va yetkazish bosqichlari davomiyligi",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+EVENTS = Counter(
+    "hik_events_total",
+    "Qabul qilingan hodisalar natijasi bo'yicha",
+    ["result"],
+)
+
+CACHE_LOOKUPS = Counter(
+    "hik_cache_lookups_total",
+    "Kesh so'rovlari (layer: l1/redis, result: hit/miss)",
+    ["layer", "result"],
+)
+
+DEVICE_ERRORS = Counter(
+    "hik_device_errors_total",
+    "Qurilma bilan ishlashdagi xatolar",
+    ["ip", "operation"],
+)
+
+QUEUE_DEPTH = Gauge(
+    "hik_queue_depth",
+    "Fon navbatlaridagi kutayotgan vazifalar",
+    ["queue"],
+)
+
+
+def stage_timer(stage: str):
+    """with stage_timer("sheets_append"): ... — bosqich vaqtini histogrammaga yozadi."""
+    return STAGE_LATENCY.labels(stage).time()
+
+
+def cache_lookup(layer: str, hit: bool):
+    CACHE_LOOKUPS.labels(layer, "hit" if hit else "miss").inc()
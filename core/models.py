@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, BigInteger, DateTime, func
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, BigInteger, DateTime, Index, Identity, Sequence, func
 from sqlalchemy.orm import relationship, declarative_base
 import enum
 
@@ -38,6 +38,9 @@ class Device(Base):
 
     branch = relationship("Branch", back_populates="devices")
 
+# Yangi xodimlar uchun 6 xonali account_id manbai (core.directory_sync)
+ACCOUNT_ID_SEQ = Sequence('employee_account_id_seq', start=100000, minvalue=100000, maxvalue=999999, metadata=Base.metadata)
+
 class Employee(Base):
     __tablename__ = 'employees'
 
@@ -47,7 +50,89 @@ class Employee(Base):
     branch_id = Column(Integer, ForeignKey('branches.id'))
     
     photo_status = Column(Boolean, default=False) 
+    # core.face_store dagi tasdiqlangan yuz rasmining sha256 xeshi
+    photo_hash = Column(String(64), nullable=True)
 
     notification_chat_id = Column(BigInteger, nullable=True) 
 
-    branch = relationship("Branch", back_populates="employees")
\ No newline at end of file
+    branch = relationship("Branch", back_populates="employees")
+
+class DirectoryRowFingerprint(Base):
+    """Xodimlar sheetidagi har bir qatorning oxirgi sinxronlangan holati (core.directory_sync)."""
+    __tablename__ = 'directory_row_fingerprints'
+
+    worksheet = Column(String, primary_key=True)
+    row_num = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    account_id = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class AttendanceOutbox(Base):
+    """
+    Davomat hodisalari navbati. receive_event javob qaytarishdan oldin shu yerga yoziladi,
+    OutboxWorker esa ularni Sheets va Telegramga yetkazib, bajarilgan deb belgilaydi.
+    """
+    __tablename__ = 'attendance_outbox'
+
+    id = Column(BigInteger, primary_key=True)
+    event_time = Column(DateTime(timezone=True), nullable=False)
+
+    branch_id = Column(Integer, nullable=True)
+    branch_name = Column(String, nullable=True)
+    device_ip = Column(String, nullable=True)
+    # Qurilmadagi hodisa tartib raqami (AcsEvent serialNo), backfill takrorlarini aniqlash uchun
+    device_serial = Column(BigInteger, nullable=True)
+    sheet_id = Column(String, nullable=True)
+
+    employee_id = Column(String, nullable=False)
+    employee_name = Column(String, nullable=False)
+    action = Column(String, nullable=False)
+    notif_chat_id = Column(BigInteger, nullable=True)
+
+    event_saved = Column(Boolean, default=False, nullable=False)
+    sheet_done = Column(Boolean, default=False, nullable=False)
+    notif_done = Column(Boolean, default=False, nullable=False)
+    done = Column(Boolean, default=False, nullable=False)
+
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_attendance_outbox_pending', 'next_attempt_at', postgresql_where=(done == False)),
+        Index('ix_attendance_outbox_device_serial', 'device_ip', 'device_serial'),
+    )
+
+
+class DeviceEventCursor(Base):
+    """Qurilma hodisalar tarixidan qayerdan davom ettirish kerakligi (core.backfill)."""
+    __tablename__ = 'device_event_cursors'
+
+    device_ip = Column(String, primary_key=True)
+    last_serial_no = Column(BigInteger, nullable=True)
+    last_event_time = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class AttendanceEvent(Base):
+    """
+    Har bir qayd etilgan o'tish. Jadval kun bo'yicha (Toshkent vaqti) RANGE partitsiyalangan,
+    partitsiyalar core.schema.ensure_attendance_partitions orqali yaratiladi.
+    """
+    __tablename__ = 'attendance_events'
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    ts = Column(DateTime(timezone=True), primary_key=True)
+
+    branch_id = Column(Integer, nullable=True)
+    device_ip = Column(String, nullable=True)
+    employee_account_id = Column(String, nullable=False)
+    employee_name = Column(String, nullable=False)
+    action = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index('ix_attendance_events_branch_ts', 'branch_id', 'ts'),
+        Index('ix_attendance_events_employee_ts', 'employee_account_id', 'ts'),
+        {'postgresql_partition_by': 'RANGE (ts)'},
+    )
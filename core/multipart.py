@@ -0,0 +1,118 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+
+def boundary_from(content_type: str) -> Optional[bytes]:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode()
+    return None
+
+
+def _parse_headers(block: bytes) -> Dict[str, str]:
+    headers = {}
+    for line in block.decode("latin-1").splitlines():
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def is_event_part(headers: Dict[str, str]) -> bool:
+    """Surat (image/* yoki fayl) bo'lmagan qismlar — hodisa JSON i shulardan birida keladi."""
+    if headers.get("content-type", "").startswith("image/"):
+        return False
+    return "filename=" not in headers.get("content-disposition", "")
+
+
+def parse_event_part(headers: Dict[str, str], body: bytes) -> Optional[dict]:
+    if b"eventType" not in body:
+        return None
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class MultipartStreamParser:
+    """
+    multipart (form-data yoki mixed) oqimini bo'laklab tahlil qiladi.
+    feed() to'liq yig'ilgan qismlarni (headers, body) ro'yxati sifatida qaytaradi.
+    Faqat keep(headers) rost bo'lgan qismlar xotirada yig'iladi, qolganlari
+    (masalan, JPEG suratlar) o'qilishi bilan tashlab yuboriladi.
+    """
+    def __init__(self, boundary: bytes, keep: Callable[[Dict[str, str]], bool] = None):
+        self.delimiter = b"--" + boundary
+        self.body_delimiter = b"\r\n" + self.delimiter
+        self.keep = keep or (lambda headers: True)
+        self.buffer = bytearray()
+
+        # None — keyingi chegara va sarlavhalar kutilmoqda
+        self._headers = None
+        self._body = None
+        self._remaining = None
+
+    def feed(self, chunk: bytes) -> List[Tuple[Dict[str, str], bytes]]:
+        self.buffer += chunk
+        parts = []
+        while self._step(parts):
+            pass
+        return parts
+
+    def _step(self, parts) -> bool:
+        if self._headers is None:
+            return self._read_headers()
+
+        if self._remaining is not None:
+            take = min(self._remaining, len(self.buffer))
+            if self._body is not None:
+                self._body += self.buffer[:take]
+            del self.buffer[:take]
+            self._remaining -= take
+            if self._remaining:
+                return False
+            return self._finish(parts)
+
+        end = self.buffer.find(self.body_delimiter)
+        if end < 0:
+            # Chegara ikki bo'lak orasida bo'linib qolgan bo'lishi mumkin: oxiri saqlanadi
+            safe = len(self.buffer) - len(self.body_delimiter)
+            if safe > 0:
+                if self._body is not None:
+                    self._body += self.buffer[:safe]
+                del self.buffer[:safe]
+            return False
+        if self._body is not None:
+            self._body += self.buffer[:end]
+        del self.buffer[:end]
+        return self._finish(parts)
+
+    def _read_headers(self) -> bool:
+        start = self.buffer.find(self.delimiter)
+        if start < 0:
+            keep = len(self.delimiter)
+            if len(self.buffer) > keep:
+                del self.buffer[:-keep]
+            return False
+
+        header_end = self.buffer.find(b"\r\n\r\n", start)
+        if header_end < 0:
+            del self.buffer[:start]
+            return False
+
+        self._headers = _parse_headers(bytes(self.buffer[start + len(self.delimiter):header_end]))
+        del self.buffer[:header_end + 4]
+
+        length = self._headers.get("content-length")
+        self._remaining = int(length) if length and length.isdigit() else None
+        self._body = bytearray() if self.keep(self._headers) else None
+        return True
+
+    def _finish(self, parts) -> bool:
+        if self._body is not None:
+            parts.append((self._headers, bytes(self._body)))
+        self._headers = self._body = self._remaining = None
+        return True
@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .config import settings
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+MAX_SEND_ATTEMPTS = 3
+
+# Navbat elementining yuborish usuli
+MODE_BATCH = "batch"    # boshqa xabarlar bilan birlashtirilishi mumkin
+MODE_SINGLE = "single"  # birlashtirilgan xabar rad etilgan: alohida, Markdown bilan
+MODE_PLAIN = "plain"    # Markdown rad etilgan: alohida, oddiy matn
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now) -> float:
+        """Keyingi token uchun kutish kerak bo'lgan soniyalar (0 — hozir mumkin)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class TelegramDispatcher:
+    """
+    Telegram xabarlarini bitta doimiy HTTP sessiya orqali yuboradi.
+    - global va har bir chat uchun token-bucket (flood limitlari);
+    - 429 javobidagi retry_after ga amal qiladi (faqat shu chat uchun; bir vaqtda bir nechta
+      chat 429 olsa — butun bot uchun);
+    - bir chatga to'planib qolgan xabarlar bitta xabarga birlashtiriladi. Birlashtirilgan xabar
+      4xx bilan rad etilsa, xabarlar alohida, kerak bo'lsa oddiy matn sifatida qayta yuboriladi.
+    callback(ok, error, permanent) xabar yetkazilgan yoki rad etilganda chaqiriladi.
+    """
+    def __init__(self, token: str, global_rate: float = None, chat_rate: float = None):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+        self.global_rate = global_rate or settings.TELEGRAM_GLOBAL_RATE
+        self.chat_rate = chat_rate or settings.TELEGRAM_CHAT_RATE
+        self._global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self._chat_buckets = {}
+
+        # chat_id -> deque[(text, callback, attempts, mode)]
+        self._queues = {}
+        self._blocked_until = {}
+        # chat_id -> 429 bo'yicha blok tugash vaqti
+        self._flood_until = {}
+        self._global_blocked_until = 0.0
+
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="telegram-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 15):
+        """Navbatdagi xabarlarni yuborib bo'lgach (yoki timeout tugagach) to'xtaydi."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queues and time.monotonic() < deadline:
+                self._cond.wait(min(0.5, max(0.0, deadline - time.monotonic())))
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(max(0.0, deadline - time.monotonic()) + 1)
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def submit(self, chat_id, text: str, callback=None):
+        with self._cond:
+            self._queues.setdefault(chat_id, deque()).append((text, callback, 0, MODE_BATCH))
+            self._cond.notify()
+
+    def _next_chat(self, now):
+        """Yuborishga tayyor chatni va (bo'lmasa) kutish vaqtini qaytaradi."""
+        wait = max(0.0, self._global_blocked_until - now)
+        if wait > 0:
+            return None, wait
+
+        global_wait = self._global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+
+        best_wait = None
+        for chat_id in self._queues:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+            chat_wait = max(bucket.wait_time(now), self._blocked_until.get(chat_id, 0.0) - now)
+            if chat_wait <= 0:
+                return chat_id, 0.0
+            best_wait = chat_wait if best_wait is None else min(best_wait, chat_wait)
+        return None, best_wait
+
+    def _take_batch(self, chat_id):
+        """Chat navbatidan bitta xabarga sig'adigan qismini oladi."""
+        queue = self._queues[chat_id]
+        batch = [queue.popleft()]
+        length = len(batch[0][0])
+        while (batch[0][3] == MODE_BATCH and queue and queue[0][3] == MODE_BATCH
+               and length + 2 + len(queue[0][0]) <= MAX_MESSAGE_LENGTH):
+            item = queue.popleft()
+            length += 2 + len(item[0])
+            batch.append(item)
+        if not queue:
+            del self._queues[chat_id]
+        return batch
+
+    def _requeue(self, chat_id, batch):
+        queue = self._queues.setdefault(chat_id, deque())
+        for text, callback, attempts, mode in reversed(batch):
+            queue.appendleft((text, callback, attempts + 1, mode))
+
+    def _flood_block(self, chat_id, retry_after):
+        """
+        429 odatda bitta chatga tegishli. Boshqa chat ham hali 429 blokida bo'lsa,
+        cheklov butun botga qo'yilgan deb hisoblanadi.
+        """
+        now = time.monotonic()
+        until = now + retry_after
+        self._flood_until = {c: t for c, t in self._flood_until.items() if t > now}
+        global_limit = any(c != chat_id for c in self._flood_until)
+        self._flood_until[chat_id] = until
+        self._blocked_until[chat_id] = max(self._blocked_until.get(chat_id, 0.0), until)
+        if global_limit:
+            self._global_blocked_until = max(self._global_blocked_until, until)
+        return global_limit
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped and not self._queues:
+                        return
+                    now = time.monotonic()
+                    chat_id, wait = self._next_chat(now)
+                    if chat_id is not None:
+                        break
+                    self._cond.wait(wait)
+                self._global_bucket.consume(now)
+                self._chat_buckets[chat_id].consume(now)
+                batch = self._take_batch(chat_id)
+                # Navbat bo'shagani haqida stop() ni xabardor qiladi
+                self._cond.notify_all()
+
+            self._send(chat_id, batch)
+
+            with self._cond:
+                if len(self._chat_buckets) > 10000:
+                    self._chat_buckets = {k: v for k, v in self._chat_buckets.items() if k in self._queues}
+
+    def _send(self, chat_id, batch):
+        text = "\n\n".join(item[0] for item in batch)
+        payload = {"chat_id": chat_id, "text": text}
+        if batch[0][3] != MODE_PLAIN:
+            payload["parse_mode"] = "Markdown"
+        error, permanent = None, False
+        try:
+            with stage_timer("telegram_send"):
+                resp = self.session.post(self.url, json=payload, timeout=10)
+            if resp.ok:
+                self._finish(batch, True, None, False)
+                return
+
+            error = f"{resp.status_code} {resp.text[:200]}"
+            if resp.status_code == 429:
+                retry_after = 1
+                try:
+                    retry_after = resp.json().get("parameters", {}).get("retry_after", 1)
+                except ValueError:
+                    pass
+                with self._cond:
+                    global_limit = self._flood_block(chat_id, retry_after)
+                    # 429 urinish hisoblanmaydi
+                    self._requeue(chat_id, [(t, cb, a - 1, m) for t, cb, a, m in batch])
+                    self._cond.notify()
+                scope = "barcha chatlar" if global_limit else f"chat {chat_id}"
+                logger.warning(f"Telegram flood limit: {retry_after}s kutiladi ({scope})")
+                return
+            # 400/403: chat topilmadi, bot bloklangan va h.k. — qayta urinish foydasiz
+            permanent = 400 <= resp.status_code < 500
+        except Exception as e:
+            error = str(e)
+
+        logger.error(f"Telegram alert error: {error}")
+        if permanent:
+            fallback = self._fallback(batch, resp.status_code)
+            if fallback:
+                # Bitta noto'g'ri xabar qolganlarini ham o'zi bilan olib ketmasligi uchun
+                with self._cond:
+                    self._requeue(chat_id, [(t, cb, a - 1, m) for t, cb, a, m in fallback])
+                    self._cond.notify()
+                return
+            self._finish(batch, False, error, True)
+            return
+
+        retry = [item for item in batch if item[2] + 1 < MAX_SEND_ATTEMPTS]
+        failed = [item for item in batch if item[2] + 1 >= MAX_SEND_ATTEMPTS]
+        if retry:
+            with self._cond:
+                self._blocked_until[chat_id] = time.monotonic() + 2
+                self._requeue(chat_id, retry)
+                self._cond.notify()
+        self._finish(failed, False, error, False)
+
+    @staticmethod
+    def _fallback(batch, status_code):
+        """
+        Rad etilgan xabarni yuborishning keyingi usuli: birlashtirilgan xabar alohidalarga bo'linadi,
+        400 (masalan, Markdown xatosi) olgan alohida xabar oddiy matn sifatida yuboriladi.
+        Boshqa usul qolmagan bo'lsa None.
+        """
+        if len(batch) > 1:
+            return [(text, callback, attempts, MODE_SINGLE) for text, callback, attempts, _ in batch]
+        text, callback, attempts, mode = batch[0]
+        if status_code == 400 and mode != MODE_PLAIN:
+            return [(text, callback, attempts, MODE_PLAIN)]
+        return None
+
+    def _finish(self, batch, ok, error, permanent):
+        for _, callback, _, _ in batch:
+            if callback is None: continue
+            try:
+                callback(ok, error, permanent)
+            except Exception as e:
+                logger.error(f"Telegram callback xatosi: {e}")
@@ -0,0 +1,279 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import SessionLocal
+from .models import AttendanceOutbox, AttendanceEvent
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+UZ_TZ = timezone(timedelta(hours=5))
+
+
+def _build_entry(*, sheet_id, branch_id, branch_name, device_ip,
+                 employee_id, employee_name, action, notif_chat_id, event_time=None, device_serial=None):
+    return AttendanceOutbox(
+        event_time=event_time or datetime.now(timezone.utc),
+        sheet_id=sheet_id,
+        branch_id=branch_id,
+        branch_name=branch_name,
+        device_ip=device_ip,
+        device_serial=device_serial,
+        employee_id=employee_id,
+        employee_name=employee_name,
+        action=action,
+        notif_chat_id=notif_chat_id,
+        sheet_done=not sheet_id,
+        notif_done=not notif_chat_id,
+    )
+
+
+def enqueue(db: Session, **fields):
+    """
+    Hodisani navbatga yozadi va commit qiladi.
+    Qaytgandan keyin hodisa restart yoki Sheets uzilishida ham yo'qolmaydi.
+    """
+    entry = _build_entry(**fields)
+    db.add(entry)
+    db.commit()
+    return entry
+
+
+async def enqueue_async(db: AsyncSession, **fields):
+    """enqueue ning asyncpg sessiyasi uchun varianti."""
+    entry = _build_entry(**fields)
+    db.add(entry)
+    await db.commit()
+    return entry
+
+
+def format_alert(entry: AttendanceOutbox) -> str:
+    emoji = "✅" if entry.action == "KIRISH" else "❌" if entry.action == "CHIQISH" else "⚠️"
+    event_time = entry.event_time.astimezone(UZ_TZ).strftime('%H:%M:%S')
+    return (
+        f"{emoji} **DAVOMAT BILDIRISHNOMASI**\n\n"
+        f"👤 **Xodim:** {entry.employee_name}\n"
+        f"🏢 **Filial:** {entry.branch_name}\n"
+        f"🔄 **Holat:** {entry.action}\n"
+        f"⏰ **Vaqt:** {event_time}"
+    )
+
+
+class OutboxWorker:
+    """
+    Navbatdagi yozuvlarni partiyalab yetkazadi:
+    - bir sheet va kun uchun bitta append_rows;
+    - xato bo'lsa eksponensial kutish bilan qayta urinadi;
+    - ishga tushganda qolib ketgan yozuvlarni qayta o'ynaydi;
+    - to'xtatilganda navbatni bo'shatib chiqadi.
+    """
+    def __init__(self, sheet_manager, dispatcher):
+        self.sheet_manager = sheet_manager
+        self.dispatcher = dispatcher
+        self._alerts_in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+        self.batch_size = settings.SHEETS_BATCH_SIZE
+        self.flush_interval = settings.SHEETS_FLUSH_INTERVAL
+
+        self._pending_hint = 0
+        # /metrics uchun: partiya yetkazilgandan keyin shu sessiyada yangilanadi
+        self.pending = 0
+        self._pending_stale = True
+        self._hint_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="attendance-outbox", daemon=True)
+        self._thread.start()
+        logger.info("📤 Davomat navbati ishga tushdi")
+
+    def stop(self, timeout: float = None):
+        """Yangi partiya kutmasdan navbatni bo'shatadi va to'xtaydi."""
+        timeout = settings.OUTBOX_DRAIN_TIMEOUT if timeout is None else timeout
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.process_due():
+                break
+        logger.info("📤 Davomat navbati to'xtatildi")
+
+    def notify(self):
+        """receive_event yangi yozuv qo'shganini bildiradi."""
+        with self._hint_lock:
+            self._pending_hint += 1
+            full = self._pending_hint >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        # Oldingi ishga tushirishdan qolgan yozuvlar darhol yuboriladi
+        while not self._stopped.is_set():
+            try:
+                while self.process_due():
+                    if self._stopped.is_set(): break
+            except Exception as e:
+                logger.error(f"Outbox worker xatosi: {e}")
+
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._hint_lock:
+                self._pending_hint = 0
+        self.pending = 0
+
+    def _count_pending(self, db: Session):
+        try:
+            self.pending = db.query(AttendanceOutbox.id).filter(AttendanceOutbox.done == False).count()
+            self._pending_stale = False
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Outbox hajmini o'qishda xato: {e}")
+
+    def _claim(self, db: Session):
+        now = datetime.now(timezone.utc)
+        entries = (
+            db.query(AttendanceOutbox)
+            .filter(AttendanceOutbox.done == False, AttendanceOutbox.next_attempt_at <= now)
+            .order_by(AttendanceOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        # Boshqa jarayon shu yozuvlarni qayta olmasligi uchun ijara muddati qo'yiladi
+        lease_until = now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+        for entry in entries:
+            entry.next_attempt_at = lease_until
+
+        self._save_events(db, entries)
+        db.commit()
+        return entries
+
+    def _save_events(self, db: Session, entries):
+        """attendance_events ga partiya bilan yozadi (claim bilan bitta tranzaksiyada)."""
+        new_entries = [e for e in entries if not e.event_saved]
+        if not new_entries: return
+
+        db.execute(insert(AttendanceEvent), [
+            {
+                "ts": e.event_time,
+                "branch_id": e.branch_id,
+                "device_ip": e.device_ip,
+                "employee_account_id": e.employee_id,
+                "employee_name": e.employee_name,
+                "action": e.action,
+            }
+            for e in new_entries
+        ])
+        for e in new_entries:
+            e.event_saved = True
+
+    def process_due(self) -> int:
+        """Bitta partiyani yetkazadi. Qayta ishlangan yozuvlar sonini qaytaradi."""
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            entries = self._claim(db)
+            if not entries:
+                # Bo'sh siklda sanalmaydi (faqat ishga tushgandagi birinchi yoki xato bergan sanoqdan keyin)
+                if self._pending_stale:
+                    self._count_pending(db)
+                return 0
+
+            errors = {}
+            self._deliver_sheets(entries, errors)
+
+            with self._in_flight_lock:
+                alerts = [e for e in entries if not e.notif_done and e.id not in self._alerts_in_flight]
+                self._alerts_in_flight.update(e.id for e in alerts)
+
+            self._finish(entries, errors)
+            db.commit()
+            self._count_pending(db)
+
+            # Natija _on_alert_result orqali yoziladi
+            for entry in alerts:
+                self.dispatcher.submit(entry.notif_chat_id, format_alert(entry), partial(self._on_alert_result, entry.id))
+            return len(entries)
+        finally:
+            db.close()
+
+    def _deliver_sheets(self, entries, errors):
+        groups = defaultdict(list)
+        for entry in entries:
+            if not entry.sheet_done:
+                date_str = entry.event_time.astimezone(UZ_TZ).strftime("%d.%m.%Y")
+                groups[(entry.sheet_id, date_str)].append(entry)
+
+        for (sheet_id, date_str), group in groups.items():
+            rows = [
+                [e.employee_name, e.employee_id, e.action, e.event_time.astimezone(UZ_TZ).strftime("%H:%M:%S")]
+                for e in group
+            ]
+            try:
+                with stage_timer("sheets_append"):
+                    self.sheet_manager.append_attendance_rows(sheet_id, date_str, rows)
+                for e in group:
+                    e.sheet_done = True
+                logger.info(f"📝 Sheetga {len(rows)} ta qator yozildi: {sheet_id} ({date_str})")
+            except Exception as e:
+                logger.error(f"Sheetga yozishda xato ({sheet_id}): {e}")
+                for entry in group:
+                    errors[entry.id] = f"sheet: {e}"
+
+    def _on_alert_result(self, entry_id, ok, error, permanent):
+        db = SessionLocal()
+        try:
+            entry = db.get(AttendanceOutbox, entry_id)
+            if entry is not None and not entry.done:
+                if ok or permanent:
+                    # Doimiy xato (chat topilmadi, bot bloklangan) qayta urinilmaydi
+                    entry.notif_done = True
+                    entry.done = entry.sheet_done
+                    if not ok:
+                        entry.last_error = f"telegram: {error}"
+                else:
+                    self._schedule_retry(entry, f"telegram: {error}", datetime.now(timezone.utc))
+                db.commit()
+        except Exception as e:
+            logger.error(f"Outbox alert natijasini yozishda xato: {e}")
+        finally:
+            db.close()
+            with self._in_flight_lock:
+                self._alerts_in_flight.discard(entry_id)
+
+    def _schedule_retry(self, entry, error, now):
+        entry.attempts += 1
+        entry.last_error = error
+        if entry.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            entry.done = True
+            logger.error(f"❌ Davomat yetkazilmadi, urinishlar tugadi: #{entry.id} {entry.last_error}")
+            return
+
+        delay = min(settings.OUTBOX_RETRY_BASE * (2 ** (entry.attempts - 1)), settings.OUTBOX_RETRY_MAX)
+        entry.next_attempt_at = now + timedelta(seconds=delay)
+
+    def _finish(self, entries, errors):
+        now = datetime.now(timezone.utc)
+        for entry in entries:
+            if entry.sheet_done and entry.notif_done:
+                entry.done = True
+                entry.last_error = None
+            elif entry.id in errors:
+                self._schedule_retry(entry, errors[entry.id], now)
+            # Aks holda faqat Telegram kutilmoqda: ijara muddati saqlanadi, natijani callback yozadi
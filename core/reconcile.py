@@ -0,0 +1,123 @@
+import logging
+from typing import List
+
+from .config import settings
+from .database import SessionLocal
+from .models import Device, Employee
+from .hik_device import HikDeviceClient, device_jobs
+from .face_store import face_store
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+FACE_BATCH_SIZE = 20
+
+
+def _batches(items, size=BATCH_SIZE):
+    items = sorted(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def reconcile_device(device: dict, expected: dict) -> dict:
+    """
+    Qurilmadagi foydalanuvchilarni bazadagi filial xodimlari bilan solishtiradi
+    va faqat farqni (qo'shish/o'chirish) partiyalab yuboradi.
+    expected: {account_id: photo_hash yoki None}. Rasmi omborda bo'lganlar yuzi bilan yoziladi.
+    """
+    expected_ids = set(expected)
+    result = {"ip": device['ip'], "on_device": 0, "added": 0, "deleted": 0, "no_face": 0, "errors": []}
+    client = HikDeviceClient(device['ip'], device['user'], device['pass'])
+
+    try:
+        on_device = set(client.list_user_ids())
+    except Exception as e:
+        result["errors"].append(f"Ro'yxatni o'qib bo'lmadi: {e}")
+        return result
+    result["on_device"] = len(on_device)
+
+    to_delete = on_device - expected_ids - settings.reconcile_keep_id_set
+    to_add = expected_ids - on_device
+
+    # Partiyalar orasida xodimlarning selfilari o'tkazib yuboriladi (device_jobs.run_priority)
+    for batch in _batches(to_delete):
+        device_jobs.run_priority(device['ip'])
+        if client.delete_users(batch, timeout=client.timeout):
+            result["deleted"] += len(batch)
+        else:
+            result["errors"].append(f"O'chirish xatosi: {len(batch)} ta")
+
+    with_face, without_face = [], []
+    for account_id in sorted(to_add):
+        digest = expected[account_id]
+        if digest and face_store.has(digest):
+            with_face.append((account_id, digest))
+        else:
+            without_face.append(account_id)
+
+    for start in range(0, len(with_face), FACE_BATCH_SIZE):
+        device_jobs.run_priority(device['ip'])
+        chunk = with_face[start:start + FACE_BATCH_SIZE]
+        results = client.enroll_many([(acc, face_store.get(digest)) for acc, digest in chunk])
+        for account_id, (success, msg) in results.items():
+            if success:
+                result["added"] += 1
+            else:
+                result["errors"].append(f"{account_id}: {msg}")
+
+    # Rasmi yo'q xodimlar uchun faqat foydalanuvchi yozuvi yaratiladi
+    if without_face:
+        client.ensure_access_group()
+    for batch in _batches(without_face):
+        device_jobs.run_priority(device['ip'])
+        failed = client.add_users(batch)
+        added = [u for u in batch if u not in failed]
+        if added:
+            client.add_access_group_members(added)
+        result["added"] += len(added)
+        result["no_face"] += len(added)
+        result["errors"].extend(f"{u}: {msg}" for u, msg in failed.items())
+
+    logger.info(f"🔁 {device['ip']}: +{result['added']} / -{result['deleted']} (qurilmada {result['on_device']})")
+    return result
+
+
+def _load_targets(db, devices) -> List[tuple]:
+    branch_ids = {d.branch_id for d in devices}
+    rows = (
+        db.query(Employee.account_id, Employee.branch_id, Employee.photo_hash)
+        .filter(Employee.branch_id.in_(branch_ids))
+        .all()
+    )
+    expected = {b: {} for b in branch_ids}
+    for account_id, branch_id, photo_hash in rows:
+        expected[branch_id][account_id] = photo_hash
+    return [
+        ({'ip': d.ip_address, 'user': d.username, 'pass': d.password}, expected[d.branch_id])
+        for d in devices
+    ]
+
+
+def _run(targets) -> List[dict]:
+    futures = [device_jobs.submit(device['ip'], reconcile_device, device, expected) for device, expected in targets]
+    return [future.result() for future in futures]
+
+
+def reconcile_branch(branch_id: int) -> List[dict]:
+    db = SessionLocal()
+    try:
+        devices = db.query(Device).filter(Device.branch_id == branch_id).all()
+        targets = _load_targets(db, devices)
+    finally:
+        db.close()
+    return _run(targets)
+
+
+def reconcile_device_by_ip(ip: str) -> List[dict]:
+    db = SessionLocal()
+    try:
+        devices = db.query(Device).filter(Device.ip_address == ip).all()
+        targets = _load_targets(db, devices)
+    finally:
+        db.close()
+    return _run(targets)
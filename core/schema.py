@@ -0,0 +1,49 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from .models import AttendanceEvent
+
+logger = logging.getLogger(__name__)
+
+UZ_TZ = timezone(timedelta(hours=5))
+
+def ensure_attendance_partitions(engine, days_ahead: int = 7, days_back: int = 1):
+    """
+    attendance_events uchun kunlik partitsiyalarni oldindan yaratadi.
+    Chegaradan tashqaridagi yozuvlar DEFAULT partitsiyaga tushadi.
+    """
+    table = AttendanceEvent.__tablename__
+    today = datetime.now(UZ_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    statements = [f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"]
+    for offset in range(-days_back, days_ahead + 1):
+        start = today + timedelta(days=offset)
+        end = start + timedelta(days=1)
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS {table}_{start:%Y%m%d} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+    for statement in statements:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(statement))
+        except Exception as e:
+            # Masalan, DEFAULT partitsiyada shu kunga oid yozuvlar bo'lsa
+            logger.warning(f"Partitsiya yaratilmadi: {e}")
+
+    logger.info(f"🗂 {table} partitsiyalari tayyor (+{days_ahead} kun)")
+
+
+# create_all mavjud jadvallarga ustun qo'shmaydi
+COLUMN_UPGRADES = [
+    "ALTER TABLE attendance_outbox ADD COLUMN IF NOT EXISTS event_saved BOOLEAN NOT NULL DEFAULT false",
+    "ALTER TABLE employees ADD COLUMN IF NOT EXISTS photo_hash VARCHAR(64)",
+    "ALTER TABLE attendance_outbox ADD COLUMN IF NOT EXISTS device_serial BIGINT",
+    "CREATE INDEX IF NOT EXISTS ix_attendance_outbox_device_serial ON attendance_outbox (device_ip, device_serial)",
+]
+
+def upgrade_columns(engine):
+    with engine.begin() as conn:
+        for statement in COLUMN_UPGRADES:
+            conn.execute(text(statement))
@@ -1,8 +1,9 @@
 import gspread
-from gspread.utils import rowcol_to_a1
+from gspread.utils import rowcol_to_a1, absolute_range_name
 from google.oauth2.service_account import Credentials
 from datetime import datetime, timedelta, timezone
 import logging
+import threading
 from .config import settings, SHEET_COLUMNS, START_ROW
 
 logger = logging.getLogger(__name__)
@@ -13,6 +14,11 @@ class GoogleSheetManager:
         self.creds = Credentials.from_service_account_file(settings.GOOGLE_CREDS_FILE, scopes=self.scopes)
         self.client = gspread.authorize(self.creds)
 
+        # (sheet_id) -> Spreadsheet, (sheet_id, date_str) -> Worksheet
+        self._spreadsheets = {}
+        self._daily_sheets = {}
+        self._cache_lock = threading.Lock()
+
     def _safe_get(self, row, index):
         try:
             val = row[index]
@@ -20,59 +26,74 @@ class GoogleSheetManager:
         except IndexError:
             return ""
 
+    def _directory_titles(self, spreadsheet):
+        """
+        Sozlamadagi varaq nomlari — so'rovsiz. Sozlanmagan bo'lsa birinchi varaq
+        (faqat shu holda metadata so'raladi).
+        """
+        if settings.google_worksheet_name_list:
+            return list(settings.google_worksheet_name_list)
+        return [spreadsheet.sheet1.title]
+
+    @staticmethod
+    def _column_range(title, index):
+        """Masalan: 'Xodimlar'!P3:P — START_ROW dan pastgacha bitta ustun."""
+        letter = rowcol_to_a1(1, index + 1).rstrip("0123456789")
+        return absolute_range_name(title, f"{letter}{START_ROW}:{letter}")
+
     def get_all_employees_raw(self):
         """
         Xodimlarni o'qiydi (Admin Sync uchun).
+        Barcha varaqlardan faqat SHEET_COLUMNS dagi ustunlar bitta values:batchGet so'rovida olinadi.
+        (varaq nomi, qator raqami, ma'lumot) ro'yxatini qaytaradi.
         """
         results = []
         try:
-            spreadsheet = self.client.open_by_key(settings.GOOGLE_SPREADSHEET_ID)
+            spreadsheet = self._get_spreadsheet(settings.GOOGLE_SPREADSHEET_ID)
+            titles = self._directory_titles(spreadsheet)
         except Exception as e:
             logger.error(f"Spreadsheetni ochishda xato: {e}")
             return []
 
-        worksheets_to_process = []
-        if settings.google_worksheet_name_list:
-            for name in settings.google_worksheet_name_list:
-                try:
-                    worksheets_to_process.append(spreadsheet.worksheet(name))
-                except: pass
-        else:
-            try:
-                worksheets_to_process.append(spreadsheet.get_worksheet(0))
-            except: pass
+        if not titles:
+            return []
 
-        for worksheet in worksheets_to_process:
-            try:
-                rows = worksheet.get_all_values()[START_ROW-1:]
-                for i, row in enumerate(rows):
-                    real_row_num = i + START_ROW 
-                    acc_id = self._safe_get(row, SHEET_COLUMNS['account_id'])
-                    full_name = self._safe_get(row, SHEET_COLUMNS['full_name'])
-                    branch_name = self._safe_get(row, SHEET_COLUMNS['branch_name'])
-                    phone = self._safe_get(row, SHEET_COLUMNS['phone'])
-                    
-                    if not full_name: continue
-
-                    data = {
-                        "account_id": acc_id,
-                        "full_name": full_name,
-                        "branch_name": branch_name,
-                        "phone": phone
-                    }
-                    results.append((worksheet, real_row_num, data))
+        fields = list(SHEET_COLUMNS)
+        ranges = [self._column_range(title, SHEET_COLUMNS[field]) for title in titles for field in fields]
+        try:
+            response = spreadsheet.values_batch_get(ranges, params={"majorDimension": "COLUMNS"})
+        except Exception as e:
+            logger.error(f"Varaqlarni o'qishda xato: {e}")
+            return []
 
-            except Exception as e:
-                logger.error(f"Varaq xatosi: {e}")
+        value_ranges = response.get("valueRanges", [])
+        for n, title in enumerate(titles):
+            columns = {}
+            for k, field in enumerate(fields):
+                values = value_ranges[n * len(fields) + k].get("values") or [[]]
+                columns[field] = values[0]
+
+            # Bo'sh kataklar oxiridan qisqartirilgan: ustunlar uzunligi turlicha bo'lishi mumkin
+            row_count = max(len(col) for col in columns.values())
+            for i in range(row_count):
+                data = {field: self._safe_get(columns[field], i) for field in fields}
+                if not data["full_name"]: continue
+                results.append((title, i + START_ROW, {
+                    "account_id": data["account_id"],
+                    "full_name": data["full_name"],
+                    "branch_name": data["branch_name"],
+                    "phone": data["phone"]
+                }))
 
         return results
 
-    def batch_update_ids(self, worksheet, updates):
+    def batch_update_ids(self, title, updates):
         """
-        Admin Sync uchun ID larni ommaviy yozish.
+        Admin Sync uchun ID larni ommaviy yozish. Varaq faqat yozish kerak bo'lganda ochiladi.
         """
         if not updates: return True
         try:
+            worksheet = self._get_spreadsheet(settings.GOOGLE_SPREADSHEET_ID).worksheet(title)
             col_num = SHEET_COLUMNS['account_id'] + 1
             batch_data = []
             for row_num, new_id in updates:
@@ -130,35 +151,60 @@ class GoogleSheetManager:
 
             return worksheet
 
-    def log_attendance(self, sheet_id: str, employee_name: str, employee_id: str, action: str):
+    @staticmethod
+    def _today_str():
+        uz_tz = timezone(timedelta(hours=5))
+        return datetime.now(uz_tz).strftime("%d.%m.%Y")
+
+    def _get_spreadsheet(self, sheet_id: str):
+        with self._cache_lock:
+            spreadsheet = self._spreadsheets.get(sheet_id)
+        if spreadsheet is None:
+            spreadsheet = self.client.open_by_key(sheet_id)
+            with self._cache_lock:
+                self._spreadsheets[sheet_id] = spreadsheet
+        return spreadsheet
+
+    def _get_daily_worksheet(self, sheet_id: str, date_str: str):
         """
-        Davomatni yozish. 
-        Avtomatik ravishda bugungi sana bilan varaq ochadi.
+        Kunlik varaqni keshdan oladi, bo'lmasa ochadi/yaratadi.
+        Toshkent vaqti bilan yarim tundan keyin eski kun yozuvlari tashlanadi.
         """
-        try:
-            if not sheet_id: return
-            
-            try:
-                spreadsheet = self.client.open_by_key(sheet_id)
-            except Exception as e:
-                logger.error(f"Sheet ID noto'g'ri yoki ruxsat yo'q: {sheet_id}")
-                return
-            
-            uz_tz = timezone(timedelta(hours=5))
-            now = datetime.now(uz_tz)
-            date_str = now.strftime("%d.%m.%Y") 
-            time_str = now.strftime("%H:%M:%S")
+        key = (sheet_id, date_str)
+        with self._cache_lock:
+            worksheet = self._daily_sheets.get(key)
+        if worksheet is not None:
+            return worksheet
 
-            worksheet = self._get_or_create_daily_sheet(spreadsheet, date_str)
-            
-            row = [
-                employee_name,  
-                employee_id,    
-                action,         
-                time_str        
-            ]
-            
-            worksheet.append_row(row)
+        spreadsheet = self._get_spreadsheet(sheet_id)
+        worksheet = self._get_or_create_daily_sheet(spreadsheet, date_str)
 
-        except Exception as e:
-            logger.error(f"Log error: {e}")
\ No newline at end of file
+        today = self._today_str()
+        with self._cache_lock:
+            for old_key in [k for k in self._daily_sheets if k[1] != today]:
+                del self._daily_sheets[old_key]
+            self._daily_sheets[key] = worksheet
+        return worksheet
+
+    def invalidate(self, sheet_id: str):
+        """Sheet o'chirilganda yoki ruxsat olib qo'yilganda keshni tozalaydi."""
+        with self._cache_lock:
+            self._spreadsheets.pop(sheet_id, None)
+            for key in [k for k in self._daily_sheets if k[0] == sheet_id]:
+                del self._daily_sheets[key]
+
+    def append_attendance_rows(self, sheet_id: str, date_str: str, rows):
+        """
+        Bir nechta davomat qatorini bitta append_rows so'rovi bilan yozadi.
+        Xatolik bo'lsa exception yuqoriga uzatiladi (qayta urinish uchun).
+        """
+        worksheet = self._get_daily_worksheet(sheet_id, date_str)
+        try:
+            worksheet.append_rows(rows)
+        except gspread.exceptions.APIError as e:
+            status = getattr(e.response, "status_code", None)
+            # 400: varaq o'chirilgan, 403: ruxsat yo'q, 404: sheet o'chirilgan
+            if status in (400, 403, 404):
+                logger.warning(f"Sheet keshi tozalandi ({sheet_id}): {status}")
+                self.invalidate(sheet_id)
+            raise
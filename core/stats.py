@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from sqlalchemy import func, select
+
+from .cache import LocalTTLCache
+from .config import settings
+from .database import SessionLocal
+from .models import Branch, Device, Employee, AttendanceEvent
+
+UZ_TZ = timezone(timedelta(hours=5))
+
+_stats_cache = LocalTTLCache(maxsize=1, ttl=settings.STATS_CACHE_TTL)
+
+
+def _grouped_counts(db, column, group_by, *where) -> dict:
+    stmt = select(group_by, func.count(column)).group_by(group_by)
+    if where:
+        stmt = stmt.where(*where)
+    return dict(db.execute(stmt).all())
+
+
+def branch_stats(use_cache: bool = True) -> List[dict]:
+    """
+    Har bir filial uchun qurilmalar, xodimlar soni va bugun kelgan xodimlar.
+    Har bir ko'rsatkich bitta GROUP BY so'rovi; natija qisqa muddat keshlanadi.
+    """
+    if use_cache:
+        cached = _stats_cache.get("branches")
+        if cached is not None:
+            return cached
+
+    today = datetime.now(UZ_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    db = SessionLocal()
+    try:
+        branches = db.execute(select(Branch.id, Branch.name, Branch.attendance_sheet_id).order_by(Branch.id)).all()
+        devices = _grouped_counts(db, Device.id, Device.branch_id)
+        employees = _grouped_counts(db, Employee.id, Employee.branch_id)
+        # ts bo'yicha filtr faqat bugungi partitsiyani o'qiydi
+        present = _grouped_counts(
+            db, AttendanceEvent.employee_account_id.distinct(), AttendanceEvent.branch_id,
+            AttendanceEvent.ts >= today, AttendanceEvent.action == "KIRISH",
+        )
+    finally:
+        db.close()
+
+    stats = [
+        {
+            "id": b.id,
+            "name": b.name,
+            "sheet_id": b.attendance_sheet_id,
+            "devices": devices.get(b.id, 0),
+            "employees": employees.get(b.id, 0),
+            "present_today": present.get(b.id, 0),
+        }
+        for b in branches
+    ]
+    _stats_cache.set("branches", stats)
+    return stats
+
+
+def invalidate_branch_stats():
+    """Filial yoki qurilma qo'shilganda keyingi so'rov yangi ma'lumot olishi uchun."""
+    _stats_cache.clear()
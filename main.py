@@ -4,9 +4,14 @@ import uvicorn
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler
 
 from core.config import settings
-from core.database import engine
+from core.database import engine, SessionLocal
+from core.cache import cache
 from core.models import Base
+from core.schema import ensure_attendance_partitions, upgrade_columns
 from core.hik_server import app as fastapi_app
+from core.directory_sync import run_directory_sync
+from core.sheets import GoogleSheetManager
+from core.stats import invalidate_branch_stats
 
 from bot import states
 from bot.handlers import admin, employee, common
@@ -18,13 +23,43 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 Base.metadata.create_all(bind=engine)
+upgrade_columns(engine)
+ensure_attendance_partitions(engine)
+
+def maintain_partitions(context):
+    ensure_attendance_partitions(engine)
+
+def warm_up_cache(context=None):
+    db = SessionLocal()
+    try:
+        cache.warm_up(db)
+    finally:
+        db.close()
+
+# Rejali sinxronizatsiya uchun: avtorizatsiya va jadval ochish har safar takrorlanmaydi
+directory_sheets = GoogleSheetManager()
+
+def sync_directory_job(context):
+    try:
+        report = run_directory_sync(directory_sheets)
+    except Exception as e:
+        logger.error(f"Rejali katalog sinxronizatsiyasi xatosi: {e}")
+        return
+    if report and not report.get("empty"):
+        if report["new"] or report["updated"] or report["removed"] or report["changed"]:
+            invalidate_branch_stats()
+        logger.info(f"📒 Rejali sinxronizatsiya: {report['rows']} ta o'zgargan qator, {report['removed']} ta o'chirilgan")
+
+server = uvicorn.Server(uvicorn.Config(fastapi_app, host="0.0.0.0", port=settings.SERVER_PORT, log_level="warning"))
 
 def run_fastapi():
-    uvicorn.run(fastapi_app, host="0.0.0.0", port=settings.SERVER_PORT, log_level="warning")
+    server.run()
 
 def main():
     logger.info("🚀 FaceID Tizimi ishga tushmoqda...")
 
+    warm_up_cache()
+
     server_thread = threading.Thread(target=run_fastapi, daemon=True)
     server_thread.start()
     logger.info(f"📡 Hikvision Server {settings.SERVER_PORT}-portda tinglamoqda...")
@@ -32,6 +67,11 @@ def main():
     updater = Updater(settings.BOT_TOKEN, use_context=True)
     dp = updater.dispatcher
 
+    updater.job_queue.run_repeating(maintain_partitions, interval=6 * 3600, first=6 * 3600)
+    updater.job_queue.run_repeating(warm_up_cache, interval=settings.CACHE_WARMUP_INTERVAL, first=settings.CACHE_WARMUP_INTERVAL)
+    if settings.DIRECTORY_SYNC_INTERVAL:
+        updater.job_queue.run_repeating(sync_directory_job, interval=settings.DIRECTORY_SYNC_INTERVAL, first=60)
+
     branch_conv = ConversationHandler(
         entry_points=[MessageHandler(Filters.regex('^➕ Filial'), admin.add_branch_start)],
         states={
@@ -62,10 +102,18 @@ def main():
         fallbacks=[MessageHandler(Filters.regex('^⬅️'), common.cancel)]
     )
 
+    bulk_conv = ConversationHandler(
+        entry_points=[MessageHandler(Filters.regex('^📦'), admin.bulk_import_start)],
+        states={
+            states.BULK_ZIP: [MessageHandler(Filters.document, admin.get_bulk_zip)],
+        },
+        fallbacks=[MessageHandler(Filters.regex('^⬅️'), common.cancel)]
+    )
+
     emp_conv = ConversationHandler(
         entry_points=[
             MessageHandler(
-                Filters.text & ~Filters.command & ~Filters.regex('^(➕|🔄|📋|🔔|⬅️)'), 
+                Filters.text & ~Filters.command & ~Filters.regex('^(➕|🔄|📋|🔔|📦|⬅️)'), 
                 employee.handle_id
             )
         ],
@@ -79,17 +127,23 @@ def main():
     )
 
     dp.add_handler(CommandHandler("start", common.start))
+    dp.add_handler(CommandHandler("reconcile", admin.reconcile_command))
     dp.add_handler(MessageHandler(Filters.regex('^🔄 Google'), admin.sync_sheets))
     dp.add_handler(MessageHandler(Filters.regex('^📋 Ma\'lumotlar'), admin.list_info))
     
     dp.add_handler(branch_conv)
     dp.add_handler(device_conv)
     dp.add_handler(notif_conv)
+    dp.add_handler(bulk_conv)
     dp.add_handler(emp_conv)
 
     logger.info("🤖 Telegram Bot ishga tushdi va xabarlarni kutmoqda...")
     updater.start_polling()
     updater.idle()
 
+    logger.info("🛑 To'xtatilmoqda: navbatdagi davomatlar yetkazilmoqda...")
+    server.should_exit = True
+    server_thread.join(timeout=settings.OUTBOX_DRAIN_TIMEOUT + 10)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file